@@ -0,0 +1,147 @@
+#! /usr/bin/python3
+
+# Converts many workbooks with xlsx2xml or xlsx2md, one child process per
+# workbook. Every child runs under a wall-clock timeout and an address-space
+# limit; a child that exceeds either is killed and reported, and the batch
+# carries on with the remaining workbooks.
+
+import argparse
+import functools
+import multiprocessing
+import multiprocessing.connection
+import os
+import resource
+import sys
+import time
+from collections import deque
+
+import xlsx2md
+import xlsx2xml
+from conversion_cache import ConversionCache
+
+MEGABYTE = 1024 * 1024
+
+def convert_xml(filename, output_dir, cache=None, reader='openpyxl'):
+    # convert_all() prints to stdout for a lone input without an output
+    # directory, so the directory of the workbook is passed explicitly.
+    output_dir = output_dir or os.path.dirname(filename) or '.'
+    output_path = xlsx2xml.output_filename(filename, output_dir)
+    key = None
+    if cache:
+        try:
+            key = cache.key(filename)
+        except OSError:
+            # Reported by convert_all() like any other unreadable workbook.
+            key = None
+    if key:
+        cached = cache.load(key)
+        if cached is not None:
+            print('Reusing cached conversion of ' + filename)
+            with open(output_path, 'w', encoding='utf-8') as fs:
+                fs.write(cached['xml'])
+            return 0
+    failed = xlsx2xml.convert_all([filename], output_dir, reader=reader)
+    if failed:
+        return 1
+    if key:
+        with open(output_path, 'r', encoding='utf-8') as fs:
+            cache.store(key, {'xml': fs.read()})
+    return 0
+
+def convert_md(filename, output_dir, cache=None, reader='openpyxl'):
+    return xlsx2md.main(filename, output_dir or '.', cache=cache, reader=reader)
+
+CONVERTERS = {
+    'xml': convert_xml,
+    'md':  convert_md,
+}
+
+def run_child(converter, filename, output_dir, memory_limit):
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    sys.exit(converter(filename, output_dir))
+
+class Job:
+
+    def __init__(self, filename, output_dir):
+        self.filename = filename
+        self.output_dir = output_dir
+        self.process = None
+        self.started = None
+        self.status = None
+
+def run_supervised(jobs, converter, timeout=None, memory_limit=None, workers=1):
+    # jobs: Job instances; timeout in seconds, memory_limit in bytes.
+    # Children are forked so they start with the converters already imported.
+    context = multiprocessing.get_context('fork')
+    pending = deque(jobs)
+    running = []
+    while pending or running:
+        while pending and len(running) < workers:
+            job = pending.popleft()
+            job.process = context.Process(target=run_child,
+                                          args=(converter, job.filename, job.output_dir, memory_limit))
+            job.process.start()
+            job.started = time.monotonic()
+            running.append(job)
+
+        wait_for = None
+        if timeout is not None:
+            now = time.monotonic()
+            wait_for = max(0, min(job.started + timeout - now for job in running))
+        multiprocessing.connection.wait([job.process.sentinel for job in running], wait_for)
+
+        now = time.monotonic()
+        for job in list(running):
+            if job.process.exitcode is not None:
+                job.status = 'ok' if job.process.exitcode == 0 else 'failed (exit code %d)' % job.process.exitcode
+            elif timeout is not None and now - job.started >= timeout:
+                job.process.kill()
+                job.status = 'killed after %d s' % timeout
+            else:
+                continue
+            job.process.join()
+            job.process.close()
+            running.remove(job)
+            if job.status != 'ok':
+                print('%s: %s' % (job.filename, job.status), file=sys.stderr)
+    return jobs
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert workbooks in supervised worker processes')
+    parser.add_argument('format', choices=sorted(CONVERTERS), help='converter to run on every workbook')
+    parser.add_argument('inputs', nargs='+',
+                        help='workbooks, glob patterns, or - to read paths from stdin')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='output directory (default: next to the workbook for xml, the current directory for md)')
+    parser.add_argument('-t', '--timeout', type=float, default=600,
+                        help='wall-clock seconds a workbook may take before it is killed (default: 600)')
+    parser.add_argument('-m', '--memory-limit', type=int, default=2048,
+                        help='address-space limit per workbook in MB, 0 for none (default: 2048)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='workbooks converted at the same time (default: one per CPU)')
+    parser.add_argument('-c', '--cache-dir', default=None,
+                        help='reuse earlier results for workbooks whose content, converter and templates are unchanged')
+    parser.add_argument('--reader', choices=xlsx2md.READERS, default='openpyxl',
+                        help='how worksheets are read: through openpyxl (default) or by parsing the sheet XML directly')
+    args = parser.parse_args()
+
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = [Job(filename, args.output_dir) for filename in xlsx2xml.expand_inputs(args.inputs)]
+    if args.format == 'md':
+        xlsx2md.preload_templates()
+    # The converter sources are hashed once here rather than in every child.
+    cache = ConversionCache(args.cache_dir, args.format) if args.cache_dir else None
+    converter = functools.partial(CONVERTERS[args.format], cache=cache, reader=args.reader)
+    run_supervised(jobs, converter, args.timeout, args.memory_limit * MEGABYTE, args.jobs)
+
+    offenders = [job for job in jobs if job.status != 'ok']
+    print('Converted %d of %d workbooks' % (len(jobs) - len(offenders), len(jobs)), file=sys.stderr)
+    if offenders:
+        sys.exit(1)
+
+#Python3
+if __name__ == '__main__':
+    main()
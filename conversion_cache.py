@@ -0,0 +1,63 @@
+#! /usr/bin/python3
+
+# Persistent cache of conversion results keyed by content hashes.
+#
+# A key covers the workbook bytes, the sources of the converter that produced
+# the result (scripts, bindings and Mustache templates) and any extra inputs
+# the output depends on, so an entry can only be reused when converting again
+# would produce exactly the same files.
+
+import hashlib
+import json
+import os
+
+# The converters live next to this module and read their templates from
+# here as well (see xlsx2md.TEMPLATE_DIR).
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CONVERTER_SOURCES = {
+    'md':  ['xlsx2md.py', 'xlsx_reader.py', 'TestCase.mustache', 'TestSpecification.mustache', 'ExperimentSpecification.mustache'],
+    'xml': ['xlsx2xml.py', 'xlsx_reader.py', 'IEC62559.py'],
+}
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fs:
+        for chunk in iter(lambda: fs.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ConversionCache:
+
+    def __init__(self, cache_dir, kind):
+        self.cache_dir = os.path.join(cache_dir, kind)
+        digest = hashlib.sha256(kind.encode('utf-8'))
+        for name in CONVERTER_SOURCES[kind]:
+            digest.update(name.encode('utf-8'))
+            digest.update(file_digest(os.path.join(HERE, name)).encode('ascii'))
+        self.converter_digest = digest.hexdigest()
+
+    def key(self, filename, *extra):
+        digest = hashlib.sha256(self.converter_digest.encode('ascii'))
+        digest.update(file_digest(filename).encode('ascii'))
+        for value in extra:
+            digest.update(b'\0' + str(value).encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def load(self, key):
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as fs:
+                return json.load(fs)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, key, value):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as fs:
+            json.dump(value, fs)
+        os.replace(tmp_path, path)
@@ -0,0 +1,308 @@
+#! /usr/bin/python3
+
+# Long-running conversion service for workbook uploads.
+#
+# Workbooks are POSTed as the raw request body and converted by a fixed pool
+# of worker processes that have xlsx2xml (with the IEC62559 bindings) and
+# xlsx2md imported and the Mustache templates loaded before the first request
+# arrives, so an upload only pays for its own conversion.
+#
+#   POST /convert/xml                  -> the UseCaseRepository XML
+#   POST /convert/md?name=&modified=   -> a zip of the Markdown pages
+#   GET  /health                       -> 200 while every worker is alive
+#   GET  /metrics                      -> request counters and timings (JSON)
+#
+# Requests beyond the number of workers wait for one, up to --queue-limit of
+# them; further uploads are turned away with 503. A conversion that runs past
+# --timeout has its worker killed and replaced and is answered with 504.
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import sys
+import threading
+import time
+import zipfile
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+MEGABYTE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'xml': 'application/xml',
+    'md':  'application/zip',
+}
+
+class QueueFull(Exception):
+    pass
+
+class ConversionTimeout(Exception):
+    pass
+
+class WorkerFailed(Exception):
+    pass
+
+class ConversionFailed(Exception):
+    pass
+
+def markdown_zip(documents):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for path in sorted(documents):
+            archive.writestr(path.replace(os.sep, '/'), documents[path])
+    return buffer.getvalue()
+
+def convert(kind, data, name, modified, reader='openpyxl'):
+    # Runs in a worker: returns the response body for one upload.
+    if kind == 'xml':
+        import xlsx2xml
+        return xlsx2xml.workbook_to_xml(data, reader)
+    import xlsx2md
+    return markdown_zip(xlsx2md.workbook_to_markdown(data, name, modified, reader))
+
+def worker_loop(conn, memory_limit, reader):
+    # Ctrl-C stops the server, which then stops its workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    import xlsx2md
+    xlsx2md.preload_templates()
+    while True:
+        try:
+            kind, data, name, modified = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send(('ok', convert(kind, data, name, modified, reader)))
+        except Exception as e:
+            conn.send(('error', '%s: %s' % (type(e).__name__, e)))
+
+class Worker:
+
+    def __init__(self, context, memory_limit, reader):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=worker_loop, args=(child_conn, memory_limit, reader), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class WorkerPool:
+
+    def __init__(self, workers=1, queue_limit=0, timeout=None, memory_limit=None, reader='openpyxl'):
+        # Workers are started by a fork server that imported the converters
+        # once, so starting or replacing one never re-imports the bindings
+        # and never forks the threads of the HTTP server.
+        self.context = multiprocessing.get_context('forkserver')
+        self.context.set_forkserver_preload(['xlsx2xml', 'xlsx2md'])
+        self.timeout      = timeout
+        self.memory_limit = memory_limit
+        self.reader       = reader
+        self.slots        = threading.BoundedSemaphore(workers + queue_limit)
+        self.idle         = queue.Queue()
+        self.workers      = [Worker(self.context, memory_limit, reader) for _ in range(workers)]
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.lock    = threading.Lock()
+        self.metrics = {
+            'requests':           0,
+            'completed':          0,
+            'conversion_errors':  0,
+            'rejected':           0,
+            'timed_out':          0,
+            'worker_failures':    0,
+            'in_progress':        0,
+            'conversion_seconds': 0.0,
+        }
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.metrics[name] = self.metrics[name] + amount
+
+    def snapshot(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics['workers'] = len(self.workers)
+        metrics['idle_workers'] = self.idle.qsize()
+        return metrics
+
+    def healthy(self):
+        return all(worker.process.is_alive() for worker in list(self.workers))
+
+    def replace(self, worker):
+        worker.stop()
+        replacement = Worker(self.context, self.memory_limit, self.reader)
+        with self.lock:
+            self.workers[self.workers.index(worker)] = replacement
+        return replacement
+
+    def convert(self, kind, data, name, modified):
+        self.count('requests')
+        if not self.slots.acquire(blocking=False):
+            self.count('rejected')
+            raise QueueFull()
+        self.count('in_progress')
+        try:
+            deadline = None if self.timeout is None else time.monotonic() + self.timeout
+            try:
+                worker = self.idle.get(timeout=self.timeout)
+            except queue.Empty:
+                self.count('timed_out')
+                raise ConversionTimeout()
+            started = time.monotonic()
+            try:
+                worker.conn.send((kind, data, name, modified))
+                remaining = None if deadline is None else max(0, deadline - time.monotonic())
+                if not worker.conn.poll(remaining):
+                    self.count('timed_out')
+                    worker = self.replace(worker)
+                    raise ConversionTimeout()
+                status, result = worker.conn.recv()
+            except (EOFError, OSError):
+                # Killed by the memory limit or crashed.
+                self.count('worker_failures')
+                worker = self.replace(worker)
+                raise WorkerFailed()
+            finally:
+                self.idle.put(worker)
+            self.count('conversion_seconds', time.monotonic() - started)
+            if status != 'ok':
+                self.count('conversion_errors')
+                raise ConversionFailed(result)
+            self.count('completed')
+            return result
+        finally:
+            self.count('in_progress', -1)
+            self.slots.release()
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    # The pool and the upload limit are set on the server.
+
+    def send_body(self, code, body, content_type, headers=()):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        view = memoryview(body)
+        for start in range(0, len(view), CHUNK_SIZE):
+            self.wfile.write(view[start:start + CHUNK_SIZE])
+
+    def send_text(self, code, message):
+        self.send_body(code, (message + '\n').encode('utf-8'), 'text/plain; charset=utf-8')
+
+    def send_json(self, code, value):
+        self.send_body(code, json.dumps(value, indent=1, sort_keys=True).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            healthy = self.server.pool.healthy()
+            self.send_json(200 if healthy else 503, {'status': 'ok' if healthy else 'degraded'})
+        elif path == '/metrics':
+            self.send_json(200, self.server.pool.snapshot())
+        else:
+            self.send_text(404, 'Not found')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        kind = url.path[len('/convert/'):] if url.path.startswith('/convert/') else None
+        if kind not in CONTENT_TYPES:
+            self.send_text(404, 'Not found')
+            return
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.send_text(411, 'Content-Length required')
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_text(400, 'Content-Length must be a non-negative integer')
+            return
+        if length > self.server.max_upload:
+            self.send_text(413, 'Workbook larger than %d bytes' % self.server.max_upload)
+            return
+        data = self.rfile.read(length)
+
+        query = parse_qs(url.query)
+        name = query.get('name', ['workbook'])[0]
+        try:
+            modified = date.fromisoformat(query['modified'][0]) if 'modified' in query else None
+        except ValueError:
+            self.send_text(400, 'modified must be an ISO date')
+            return
+
+        try:
+            body = self.server.pool.convert(kind, data, name, modified)
+        except QueueFull:
+            self.send_text(503, 'Too many conversions waiting, try again later')
+        except ConversionTimeout:
+            self.send_text(504, 'Conversion timed out')
+        except WorkerFailed:
+            self.send_text(500, 'Conversion worker failed')
+        except ConversionFailed as e:
+            self.send_text(422, 'Conversion failed: ' + str(e))
+        else:
+            headers = []
+            if kind == 'md':
+                headers.append(('Content-Disposition', 'attachment; filename="%s.zip"' % name.replace('"', '')))
+            self.send_body(200, body, CONTENT_TYPES[kind], headers)
+
+def main():
+    # The server itself only needs xlsx2md for the reader choices and to
+    # check the templates; the converters are imported by the workers.
+    import xlsx2md
+    parser = argparse.ArgumentParser(description='Serve workbook conversions over HTTP with warm worker processes')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8062, help='port to listen on (default: 8062)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('-q', '--queue-limit', type=int, default=16,
+                        help='uploads that may wait for a free worker before new ones are refused (default: 16)')
+    parser.add_argument('-t', '--timeout', type=float, default=120,
+                        help='seconds a request may wait and convert before it is answered with 504 (default: 120)')
+    parser.add_argument('-m', '--memory-limit', type=int, default=2048,
+                        help='address-space limit per worker in MB, 0 for none (default: 2048)')
+    parser.add_argument('--max-upload', type=int, default=50,
+                        help='largest accepted workbook in MB (default: 50)')
+    parser.add_argument('--reader', choices=xlsx2md.READERS, default='openpyxl',
+                        help='how worksheets are read: through openpyxl (default) or by parsing the sheet XML directly')
+    args = parser.parse_args()
+
+    # Fails here, before any worker starts, if a template is missing.
+    xlsx2md.preload_templates()
+    pool = WorkerPool(args.jobs, args.queue_limit, args.timeout, args.memory_limit * MEGABYTE, args.reader)
+    server = ThreadingHTTPServer((args.host, args.port), ConversionHandler)
+    server.daemon_threads = True
+    server.pool = pool
+    server.max_upload = args.max_upload * MEGABYTE
+    print('Serving conversions on http://%s:%d/ with %d workers' % (args.host, args.port, args.jobs), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+#Python3
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#! /usr/bin/python3
+
+# Converts every workbook below the input directory to Markdown in one
+# interpreter and lays out the site the way Hugo expects it:
+#   <output>/<dir of the workbook relative to the input>/index.md (and the
+#   test/experiment specification subdirectories written by xlsx2md),
+#   the PNG images found next to each workbook, and an _index.md title stub
+#   in every directory that has no page of its own.
+# Files whose content has not changed are left untouched, and the pages of
+# workbooks or sheets that were deleted are removed.
+# Workbooks are converted in supervised worker processes (see batch_convert).
+
+import argparse
+import filecmp
+import functools
+import os
+import shutil
+import sys
+
+import xlsx2md
+from batch_convert import Job, MEGABYTE, convert_md, run_supervised
+from conversion_cache import ConversionCache
+
+DEFAULT_OUTPUT_DIR = '/github/workspace/erigrid2-test-cases'
+DEFAULT_INPUT_DIR = 'excel-input'
+
+SECTION_INDEX = '''---
+title: "{title}"
+linkTitle: "{title}"
+weight: 5
+---
+'''
+
+def find_workbooks(input_dir):
+    workbooks = []
+    for dir_path, dir_names, file_names in os.walk(input_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.endswith('.xlsx'):
+                workbooks.append(os.path.join(dir_path, file_name))
+    return workbooks
+
+def output_subdir(workbook, input_dir, output_dir):
+    relative = os.path.relpath(os.path.dirname(workbook), input_dir)
+    if relative == os.curdir:
+        return output_dir
+    return os.path.join(output_dir, relative)
+
+def copy_images(source_dir, target_dir):
+    for dir_path, dir_names, file_names in os.walk(source_dir):
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith('.png'):
+                image = os.path.join(dir_path, file_name)
+                target = os.path.join(target_dir, file_name)
+                if os.path.exists(target) and filecmp.cmp(image, target, shallow=False):
+                    continue
+                print('Copying image file ' + image + ' into ' + target_dir)
+                shutil.copy(image, target_dir)
+
+def remove_deleted_workbooks(output_dir, jobs):
+    # Output directories whose manifest names workbooks that no longer exist
+    # in the corresponding input directory lose those workbooks' files.
+    sources = {}
+    for job in jobs:
+        sources.setdefault(os.path.normpath(job.output_dir), set()).add(os.path.basename(job.filename))
+    for dir_path, dir_names, file_names in os.walk(output_dir):
+        if xlsx2md.MANIFEST_NAME in file_names:
+            xlsx2md.remove_stale_sources(dir_path, sources.get(os.path.normpath(dir_path), set()))
+
+def write_section_indexes(output_dir):
+    for dir_path, dir_names, file_names in os.walk(output_dir):
+        if 'index.md' in file_names or '_index.md' in file_names:
+            continue
+        title = os.path.basename(os.path.normpath(dir_path))
+        print('Creating title link for directory: ' + dir_path + ' with title: ' + title)
+        with open(os.path.join(dir_path, '_index.md'), 'w', encoding='utf-8') as fs:
+            fs.write(SECTION_INDEX.format(title=title))
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert all test case workbooks to a Hugo content tree')
+    parser.add_argument('output_dir', nargs='?', default=DEFAULT_OUTPUT_DIR,
+                        help='root of the generated content (default: %s)' % DEFAULT_OUTPUT_DIR)
+    parser.add_argument('cache_dir', nargs='?', default=os.environ.get('EXCEL2MD_CACHE_DIR') or None,
+                        help='conversion cache directory (default: $EXCEL2MD_CACHE_DIR, no cache if unset)')
+    parser.add_argument('-i', '--input-dir', default=DEFAULT_INPUT_DIR,
+                        help='directory searched for *.xlsx workbooks (default: %s)' % DEFAULT_INPUT_DIR)
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='workbooks converted at the same time (default: one per CPU)')
+    parser.add_argument('-t', '--timeout', type=float, default=600,
+                        help='wall-clock seconds a workbook may take before it is killed (default: 600)')
+    parser.add_argument('-m', '--memory-limit', type=int, default=2048,
+                        help='address-space limit per workbook in MB, 0 for none (default: 2048)')
+    parser.add_argument('--reader', choices=xlsx2md.READERS, default='openpyxl',
+                        help='how worksheets are read: through openpyxl (default) or by parsing the sheet XML directly')
+    args = parser.parse_args()
+
+    workbooks = find_workbooks(args.input_dir)
+    jobs = []
+    for workbook in workbooks:
+        target_dir = output_subdir(workbook, args.input_dir, args.output_dir)
+        os.makedirs(target_dir, exist_ok=True)
+        jobs.append(Job(workbook, target_dir))
+
+    # Tokenized once here; every forked worker inherits the templates.
+    xlsx2md.preload_templates()
+    cache = ConversionCache(args.cache_dir, 'md') if args.cache_dir else None
+    converter = functools.partial(convert_md, cache=cache, reader=args.reader)
+    run_supervised(jobs, converter, args.timeout, args.memory_limit * MEGABYTE, args.jobs)
+
+    for job in jobs:
+        copy_images(os.path.dirname(job.filename), job.output_dir)
+    os.makedirs(args.output_dir, exist_ok=True)
+    remove_deleted_workbooks(args.output_dir, jobs)
+    write_section_indexes(args.output_dir)
+
+    # Like the shell pipeline this replaces, a workbook that fails or is
+    # killed is reported but does not fail the site build.
+    offenders = [job for job in jobs if job.status != 'ok']
+    print('Converted %d of %d workbooks' % (len(jobs) - len(offenders), len(jobs)), file=sys.stderr)
+
+#Python3
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#! /usr/bin/python3
+
+# Checks that convert_aggregate(), which streams the use cases of many
+# workbooks through RepositoryWriter, writes byte for byte the repository
+# build_repository() and repository_to_xml() produce for the same sheets,
+# also when a workbook fails on one of its later sheets.
+
+import datetime
+import io
+
+import pytest
+from openpyxl import Workbook
+
+import xlsx2xml
+
+def fill_usecase(ws, tag):
+    # Every section of the template, with values that tell the sheets apart.
+    def put(row, column, value):
+        ws.cell(row=row, column=column, value=value)
+    put(4, 3, 'UC-' + tag)
+    put(5, 3, 'Area ' + tag)
+    put(6, 3, 'Use case ' + tag)
+    put(8, 3, '1.0')
+    put(9, 3, datetime.datetime(2021, 3, 4))
+    put(10, 3, 'Author ' + tag)
+    put(11, 3, 'changes')
+    put(12, 3, 'Draft')
+    put(14, 3, 'scope')
+    put(15, 3, 'objective')
+    put(16, 3, 'BC-' + tag)
+    put(18, 3, 'short')
+    put(19, 3, 'complete & <description>')
+    for i in range(2):
+        put(21, 3 + i, 'KPI-%s-%d' % (tag, i))
+        put(22, 3 + i, 'kpi %d' % i)
+        put(23, 3 + i, 'description')
+        put(24, 3 + i, 'objective')
+        put(26, 3 + i, 'assumption %d' % i)
+    put(27, 3, 'condition')
+    put(29, 3, 'UC-related')
+    put(30, 3, 'High')
+    put(31, 3, '1')
+    put(32, 3, 'classification')
+    put(33, 3, 'nature')
+    put(34, 3, 'k1,k2')
+    put(36, 3, 'remark')
+    put(44, 3, 'group ' + tag)
+    put(45, 3, 'group description')
+    for i in range(3):
+        put(46, 3 + i, 'actor %s%d' % (tag, i))
+        put(47, 3 + i, 'Human')
+        put(48, 3 + i, 'actor description')
+    for row in range(51, 59):
+        put(row, 3, 'reference %d' % row)
+    for i in range(2):
+        put(62, 3 + i, str(i + 1))
+        put(63, 3 + i, 'scenario %s%d' % (tag, i))
+        put(64, 3 + i, 'description')
+        put(66, 3 + i, 'trigger')
+        put(67, 3 + i, 'precondition')
+        put(68, 3 + i, 'postcondition')
+    for i in range(4):
+        put(71, 3 + i, str(i))
+        put(72, 3 + i, 'event')
+        put(73, 3 + i, 'activity %d' % i)
+        put(74, 3 + i, 'description')
+        put(75, 3 + i, 'service')
+        put(79, 3 + i, str(i % 2 + 1))
+    for i in range(2):
+        put(81, 3 + i, 'R-%s%d' % (tag, i))
+        put(82, 3 + i, 'RID-%s%d' % (tag, i))
+        put(83, 3 + i, 'requirement')
+        put(84, 3 + i, 'description')
+
+def save_workbook(path, sheets):
+    # sheets: (title, tag) pairs; a tag of None leaves the sheet empty, and a
+    # tag starting with '!' gives it an identifier and nothing else, which
+    # extracts but fails the schema check when it is serialized.
+    wb = Workbook()
+    wb.remove(wb.active)
+    for title, tag in sheets:
+        ws = wb.create_sheet(title)
+        if tag is None:
+            continue
+        if tag.startswith('!'):
+            ws['C4'] = 'UC-' + tag[1:]
+        else:
+            fill_usecase(ws, tag)
+    wb.save(str(path))
+    return str(path)
+
+@pytest.fixture
+def workbooks(tmp_path):
+    return {
+        'two':     save_workbook(tmp_path / 'two.xlsx', [('A', 'a'), ('B', 'b'), ('Notes', None)]),
+        'partial': save_workbook(tmp_path / 'partial.xlsx', [('C', 'c'), ('Broken', '!d')]),
+        'one':     save_workbook(tmp_path / 'one.xlsx', [('E', 'e')]),
+    }
+
+def expected_xml(filenames, reader):
+    sheets = []
+    for filename in filenames:
+        sheets.extend(xlsx2xml.extract_workbook(filename, reader=reader))
+    return xlsx2xml.repository_to_xml(xlsx2xml.build_repository(sheets))
+
+def aggregate_xml(filenames, reader):
+    fh = io.StringIO()
+    failed = xlsx2xml.convert_aggregate(filenames, fh, reader=reader)
+    return failed, fh.getvalue().encode('utf-8')
+
+@pytest.mark.parametrize('reader', xlsx2xml.READERS)
+def test_aggregate_matches_repository(workbooks, reader):
+    filenames = [workbooks['two'], workbooks['one']]
+    assert aggregate_xml(filenames, reader) == (0, expected_xml(filenames, reader))
+
+@pytest.mark.parametrize('reader', xlsx2xml.READERS)
+def test_aggregate_leaves_out_workbook_failing_partway(workbooks, reader):
+    with pytest.raises(Exception):
+        expected_xml([workbooks['partial']], reader)
+    failed, xml = aggregate_xml([workbooks['two'], workbooks['partial'], workbooks['one']], reader)
+    assert failed == 1
+    assert xml == expected_xml([workbooks['two'], workbooks['one']], reader)
+    assert b'UC-c' not in xml
+
+def test_aggregate_of_nothing_is_empty_repository():
+    assert aggregate_xml([], 'openpyxl') == (0, xlsx2xml.repository_to_xml(xlsx2xml.build_repository([])))
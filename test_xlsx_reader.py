@@ -0,0 +1,184 @@
+#! /usr/bin/python3
+
+# Checks the direct reader of xlsx_reader against openpyxl on workbooks built
+# here: the values xlsx2xml gets from load_sheet_grid() with either reader,
+# and the values and bold / theme-fill flags xlsx2md gets from
+# read_styled_sheets() and from a fully loaded openpyxl workbook.
+
+import datetime
+import zipfile
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.rich_text import CellRichText, TextBlock
+from openpyxl.cell.text import InlineFont
+from openpyxl.styles import Font, PatternFill
+from openpyxl.styles.colors import Color
+from openpyxl.utils.datetime import CALENDAR_MAC_1904
+
+import xlsx2md
+import xlsx2xml
+import xlsx_reader
+
+BOLD      = Font(bold=True)
+ITALIC    = Font(bold=False, italic=True)
+THEME     = PatternFill('solid', fgColor=Color(theme=2, tint=-0.15))
+INDEXED   = PatternFill('solid', fgColor=Color(indexed=22))
+RGB       = PatternFill('solid', fgColor=Color(rgb='FFCCCCCC'))
+
+def fill_values(ws):
+    ws['A1'] = 1
+    ws['B1'] = 2.5
+    ws['C1'] = -3e-05
+    ws['D1'] = True
+    ws['E1'] = False
+    ws['A2'] = datetime.datetime(2021, 3, 4, 5, 6, 7)
+    ws['B2'] = datetime.date(2020, 2, 29)
+    ws['C2'] = datetime.time(13, 45)
+    ws['D2'] = datetime.timedelta(days=1, hours=5, minutes=30)
+    ws['A3'] = 'plain'
+    ws['B3'] = CellRichText('rich ', TextBlock(InlineFont(b=True), 'text'))
+    ws['C3'] = '=A1+B1'
+    ws['D3'] = 'x005F_escaped'
+    # Rows 4 and 5 stay empty.
+    ws['B6'] = 'after a gap'
+    for row in range(10, 14):
+        ws.cell(row=row, column=1, value='=A%d+1' % (row - 9))
+    ws['Z20'] = 'far'
+
+def fill_styles(ws):
+    ws['A1'] = 'Test Case'
+    ws['B2'] = 'bold'
+    ws['B2'].font = BOLD
+    ws['B3'] = 'not bold'
+    ws['B3'].font = ITALIC
+    ws['C2'] = 'theme'
+    ws['C2'].fill = THEME
+    ws['C3'] = 'indexed'
+    ws['C3'].fill = INDEXED
+    ws['C4'] = 'rgb'
+    ws['C4'].fill = RGB
+    ws['B5'] = 'merged across'
+    ws['B5'].font = BOLD
+    ws['C5'].fill = THEME
+    ws.merge_cells('B5:C5')
+    ws['B6'] = 'merged down'
+    ws['B6'].fill = THEME
+    ws['B7'].font = BOLD
+    ws.merge_cells('B6:B8')
+    ws['C9'].fill = THEME
+    ws['C9'].font = BOLD
+
+def rewrite_parts(path, replacements, added_parts):
+    # replacements: part name -> [(old, new)], each old replaced once.
+    with zipfile.ZipFile(path) as archive:
+        parts = {name: archive.read(name).decode('utf-8') for name in archive.namelist()}
+    for name, pairs in replacements.items():
+        for old, new in pairs:
+            assert old in parts[name], (name, old)
+            parts[name] = parts[name].replace(old, new, 1)
+    parts.update(added_parts)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, text in parts.items():
+            archive.writestr(name, text)
+
+# openpyxl writes every string inline and every formula on its own. Excel
+# keeps strings in the shared string table, rich text as runs there, and a
+# filled-down formula as one shared formula: rewrite A3, D3 and A10:A13 so.
+SHARED_STRINGS = (
+    '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="2" uniqueCount="2">'
+    '<si><r><t>pl</t></r><r><rPr><b/></rPr><t xml:space="preserve">ain</t></r>'
+    '<rPh sb="0" eb="1"><t>phonetic</t></rPh></si>'
+    '<si><t>x005F_escaped</t></si>'
+    '</sst>')
+
+EXCEL_PARTS = {
+    'xl/worksheets/sheet1.xml':
+        [('<c r="A3" t="inlineStr"><is><t>plain</t></is></c>', '<c r="A3" t="s"><v>0</v></c>'),
+         ('<c r="D3" t="inlineStr"><is><t>x005F_escaped</t></is></c>', '<c r="D3" t="s"><v>1</v></c>'),
+         ('<f>A1+1</f>', '<f t="shared" ref="A10:A13" si="0">A1+1</f>')] +
+        [('<f>A%d+1</f>' % row, '<f t="shared" si="0"/>') for row in range(2, 5)],
+    '[Content_Types].xml':
+        [('</Types>', '<Override PartName="/xl/sharedStrings.xml" ContentType='
+                      '"application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>')],
+    'xl/_rels/workbook.xml.rels':
+        [('</Relationships>', '<Relationship Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                              'relationships/sharedStrings" Target="sharedStrings.xml" Id="rId99"/></Relationships>')],
+}
+
+@pytest.fixture(params=['windows', 'mac'])
+def workbook(request, tmp_path):
+    wb = Workbook()
+    if request.param == 'mac':
+        wb.epoch = CALENDAR_MAC_1904
+    fill_values(wb.active)
+    wb.active.title = 'Values'
+    fill_styles(wb.create_sheet('Styles'))
+    wb.create_sheet('Empty')
+    path = str(tmp_path / ('reader-%s.xlsx' % request.param))
+    wb.save(path)
+    rewrite_parts(path, EXCEL_PARTS, {'xl/sharedStrings.xml': SHARED_STRINGS})
+    return path
+
+def test_excel_only_parts_are_read(workbook):
+    rows = xlsx_reader.read_rows(workbook, 0, 13)
+    assert rows[2][:4] == ('plain', 'rich text', '=A1+B1', 'escaped')
+    assert [row[0] for row in rows[9:13]] == ['=A1+1', '=A2+1', '=A3+1', '=A4+1']
+
+@pytest.mark.parametrize('max_row', [None, 1, 5, 13, xlsx2xml.LAST_ROW])
+def test_sheet_grid_matches_openpyxl(workbook, max_row):
+    assert xlsx_reader.sheet_count(workbook) == xlsx2xml.count_sheets(workbook) == 3
+    for index in range(3):
+        expected = xlsx2xml.load_sheet_grid(workbook, index, max_row, reader='openpyxl')
+        actual   = xlsx2xml.load_sheet_grid(workbook, index, max_row, reader='direct')
+        # repr() tells 1 from 1.0 and True, and a date from a datetime.
+        assert [list(map(repr, row)) for row in actual.rows] == [list(map(repr, row)) for row in expected.rows]
+        assert actual.max_column == expected.max_column
+
+@pytest.mark.parametrize('reader', xlsx2xml.READERS)
+def test_sheet_grids_match_single_sheet_reads(workbook, reader):
+    grids = list(xlsx2xml.load_sheet_grids(workbook, reader=reader))
+    assert len(grids) == 3
+    for index, grid in enumerate(grids):
+        expected = xlsx2xml.load_sheet_grid(workbook, index, reader=reader)
+        assert [list(map(repr, row)) for row in grid.rows] == [list(map(repr, row)) for row in expected.rows]
+
+def test_styled_sheets_match_openpyxl(workbook):
+    expected_sheets = load_workbook(workbook).worksheets
+    actual_sheets   = xlsx_reader.read_styled_sheets(workbook)
+    assert [sheet.title for sheet in actual_sheets] == [sheet.title for sheet in expected_sheets]
+    for expected, actual in zip(expected_sheets, actual_sheets):
+        assert actual.max_row == expected.max_row
+        for row in range(1, expected.max_row + 2):
+            for column in range(1, expected.max_column + 2):
+                cell = expected.cell(row, column)
+                assert repr(actual.value(row, column)) == repr(cell.value), (expected.title, cell.coordinate)
+                assert actual.flags(row, column) == xlsx2md.style_flags(cell), (expected.title, cell.coordinate)
+
+def test_styled_sheets_tell_theme_from_indexed_fills(workbook):
+    sheet = xlsx_reader.read_styled_sheets(workbook)[1]
+    assert sheet.flags(2, 2) == (True, False)
+    assert sheet.flags(3, 2) == (False, False)
+    assert sheet.flags(2, 3) == (False, True)
+    assert sheet.flags(3, 3) == (False, False)
+    assert sheet.flags(4, 3) == (False, False)
+    # Only the top-left cell of a merged range keeps its value and style.
+    assert (sheet.value(5, 2), sheet.flags(5, 2)) == ('merged across', (True, False))
+    assert (sheet.value(5, 3), sheet.flags(5, 3)) == (None, (False, False))
+    assert (sheet.value(7, 2), sheet.flags(7, 2)) == (None, (False, False))
+    assert sheet.flags(9, 3) == (True, True)
+
+def test_styled_sheets_read_only_rendered_sheets(workbook):
+    sheets = xlsx_reader.read_styled_sheets(workbook, first_values=xlsx2md.SHEET_TYPES)
+    assert [sheet.title for sheet in sheets] == ['Styles']
+
+def test_workbook_part_declared_only_as_default(workbook):
+    # Some applications give the workbook no override and declare its
+    # content type as the default for .xml instead.
+    workbook_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml'
+    rewrite_parts(workbook, {'[Content_Types].xml': [
+        ('<Override PartName="/xl/workbook.xml" ContentType="%s" />' % workbook_type, ''),
+        ('<Default Extension="xml" ContentType="application/xml" />',
+         '<Default Extension="xml" ContentType="%s" />' % workbook_type)]}, {})
+    assert xlsx_reader.sheet_count(workbook) == len(load_workbook(workbook).worksheets) == 3
+    assert xlsx_reader.read_rows(workbook, 0, 1)[0][:2] == (1, 2.5)
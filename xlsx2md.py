@@ -1,40 +1,65 @@
 #! /usr/bin/python3
 
+import argparse
 from datetime import date
+import hashlib
+import json
 import os
 import sys
+import weakref
 import chevron
+from chevron.tokenizer import tokenize
 from openpyxl import load_workbook
 from openpyxl.cell.cell import Cell
 from openpyxl.worksheet.worksheet import Worksheet
+from conversion_cache import ConversionCache
+import xlsx_reader
+from xlsx_reader import StyledSheet
+
+# Backends that read the sheets. 'openpyxl' (the default) loads the whole
+# workbook model; 'direct' reads only the values and the bold / theme-fill
+# flags the extractors use, and only of the sheets whose A1 marks them as
+# rendered (see xlsx_reader).
+READERS = ['openpyxl', 'direct']
+
+def check_reader(reader):
+    if reader not in READERS:
+        raise ValueError('Unknown reader %r, expected one of %s' % (reader, ', '.join(READERS)))
+
+# Values of A1 that mark the sheets rendered to Markdown.
+SHEET_TYPES = ('Test Case', 'Test Specification', 'Experiment Specification')
+
+# Rows looked at by the extractors: sections end by row 999 at the latest and
+# a diagram table starting there ends three rows further down.
+LAST_ROW = 1002
 
 def extract_test_case(sheet_ranges : Worksheet):
     test_case = {}
-    test_case['id'] = sheet_ranges['C2'].value
+    test_case['id'] = cell_value(sheet_ranges, 2, 3)
     if test_case['id'] is None:
         return None
-    test_case['name'] = sheet_ranges['C3'].value
+    test_case['name'] = cell_value(sheet_ranges, 3, 3)
     extract_generic_data(sheet_ranges, test_case, start_row=4)
     return test_case
 
 def extract_test_specification(sheet_ranges):
     test_specification = {}
-    test_specification['id'] = sheet_ranges['C2'].value
+    test_specification['id'] = cell_value(sheet_ranges, 2, 3)
     if test_specification['id'] is None:
         return None
-    test_specification['parent_reference'] = sheet_ranges['C3'].value
-    test_specification['name'] = sheet_ranges['C4'].value
+    test_specification['parent_reference'] = cell_value(sheet_ranges, 3, 3)
+    test_specification['name'] = cell_value(sheet_ranges, 4, 3)
     extract_generic_data(sheet_ranges, test_specification, start_row=6, diagram_root_path='..')
     return test_specification
 
 
 def extract_experiment_specification(sheet_ranges):
     exp_spec = {}
-    exp_spec['id'] = sheet_ranges['C2'].value
+    exp_spec['id'] = cell_value(sheet_ranges, 2, 3)
     if exp_spec['id'] is None:
         return None
-    exp_spec['parent_reference'] = sheet_ranges['C3'].value
-    exp_spec['name'] = sheet_ranges['C4'].value
+    exp_spec['parent_reference'] = cell_value(sheet_ranges, 3, 3)
+    exp_spec['name'] = cell_value(sheet_ranges, 4, 3)
     extract_generic_data(sheet_ranges, exp_spec, start_row=6, diagram_root_path=os.path.join('..', '..'))
     return exp_spec
 
@@ -43,35 +68,78 @@ def extract_generic_data(sheet_ranges : Worksheet, object, start_row=1, end_row=
     if not 'subsections' in object:
         object['subsections'] = []
 
-    for row_idx in range(start_row, 1000):
-        if str(sheet_ranges['A' + str(row_idx)].value).lower() == 'diagrams':
-            break
-        
-        headline_cell = sheet_ranges['B' + str(row_idx)]
-        if headline_cell.font.bold:
+    diagrams = None
+    for headline, contents, bold, gray in index_rows(sheet_ranges, start_row):
+        if bold:
             section = {
-                'section_title': headline_cell.value,
+                'section_title': headline,
                 'subsections': []
             }
             object['subsections'].append(section)
-            if is_gray(get_cell_right(headline_cell)):
+            if gray:
                 continue
             else:
-                section['contents'] = get_cell_right(headline_cell).value
-        elif str(headline_cell.value).lower() == 'description':
-            section['contents'] = get_cell_right(headline_cell).value
-        elif str(headline_cell.value).lower() == 'diagram reference':
-            section['diagrams'] = extract_diagrams(sheet_ranges, get_cell_right(headline_cell).value, diagram_root_path=diagram_root_path)
-        elif headline_cell.value:
+                section['contents'] = contents
+        elif str(headline).lower() == 'description':
+            section['contents'] = contents
+        elif str(headline).lower() == 'diagram reference':
+            if diagrams is None:
+                diagrams = index_diagrams(sheet_ranges)
+            section['diagrams'] = extract_diagrams(diagrams, contents, diagram_root_path=diagram_root_path)
+        elif headline:
             subsection = {
-                'section_title': headline_cell.value,
-                'contents': get_cell_right(headline_cell).value
+                'section_title': headline,
+                'contents': contents
             }
             section['subsections'].append(subsection)
 
     return object
 
-def extract_diagrams(sheet : Worksheet, diagram_reference, diagram_root_path='.'):
+def index_rows(sheet_ranges : Worksheet, start_row=1, end_row=1000):
+    # One pass over columns A-C up to the "Diagrams" row, returning for each
+    # row the values of B and C, whether B is bold and, for bold rows, whether
+    # C has a theme-colored fill. Rows past the used range are all empty.
+    rows = []
+    last_row = min(end_row - 1, sheet_ranges.max_row)
+    if isinstance(sheet_ranges, StyledSheet):
+        for row in range(start_row, last_row + 1):
+            if str(sheet_ranges.value(row, 1)).lower() == 'diagrams':
+                break
+            bold = sheet_ranges.flags(row, 2)[0]
+            rows.append((sheet_ranges.value(row, 2), sheet_ranges.value(row, 3), bold, bold and sheet_ranges.flags(row, 3)[1]))
+        return rows
+    for a_cell, b_cell, c_cell in sheet_ranges.iter_rows(min_row=start_row, max_row=last_row, min_col=1, max_col=3):
+        if str(a_cell.value).lower() == 'diagrams':
+            break
+        bold = style_flags(b_cell)[0]
+        rows.append((b_cell.value, c_cell.value, bold, bold and style_flags(c_cell)[1]))
+    return rows
+
+def index_diagrams(sheet : Worksheet):
+    # Parses the table under the (last) "Diagrams" row once per sheet:
+    # ids in the first row, names below them and URIs two rows further down.
+    diagrams = {}
+    diagram_id_row = None
+    for i in range(1, 1000):
+        if str(cell_value(sheet, i, 1)).lower().strip() == 'diagrams':
+            diagram_id_row = i + 1
+
+    if diagram_id_row is None:
+        return diagrams
+
+    col = 3
+    while cell_value(sheet, diagram_id_row, col) is not None:
+        dia_id = cell_value(sheet, diagram_id_row, col)
+        if dia_id not in diagrams:
+            diagrams[dia_id] = {
+                'diagram_name': cell_value(sheet, diagram_id_row+1, col),
+                'diagram_uri': cell_value(sheet, diagram_id_row+3, col)
+            }
+        col += 1
+
+    return diagrams
+
+def extract_diagrams(diagrams, diagram_reference, diagram_root_path='.'):
     return_list = []
 
     if not diagram_reference:
@@ -79,24 +147,21 @@ def extract_diagrams(sheet : Worksheet, diagram_reference, diagram_root_path='.'
 
     diagram_references = [x.strip() for x in diagram_reference.split(';')]
 
-    for i in range(1, 1000):
-        if str(sheet['A' + str(i)].value).lower().strip() == 'diagrams':
-            diagram_id_row = i + 1
-
     for dia_ref in diagram_references:
-        col = 3
-        while sheet.cell(row=diagram_id_row, column=col).value is not None:
-            if sheet.cell(row=diagram_id_row, column=col).value == dia_ref:
-                return_list.append(
-                    {
-                        'diagram_name': sheet.cell(row=diagram_id_row+1, column=col).value,
-                        'diagram_uri': os.path.join(diagram_root_path, sheet.cell(row=diagram_id_row+3, column=col).value)
-                    })
-                break
-            col += 1
+        if dia_ref in diagrams:
+            return_list.append(
+                {
+                    'diagram_name': diagrams[dia_ref]['diagram_name'],
+                    'diagram_uri': os.path.join(diagram_root_path, diagrams[dia_ref]['diagram_uri'])
+                })
 
     return return_list
 
+def cell_value(sheet, row, column):
+    if isinstance(sheet, StyledSheet):
+        return sheet.value(row, column)
+    return sheet.cell(row, column).value
+
 def get_cell_below(cell : Cell) -> Cell:
     ws = cell.parent
     return ws[cell.column_letter() + str(cell.row + 1)]
@@ -108,10 +173,24 @@ def get_cell_right(cell : Cell) -> Cell:
 def is_gray(cell : Cell):
     return type(cell.fill.fgColor.theme) == int
 
+# Per workbook: style id -> (bold, theme-colored fill). A sheet uses only a
+# handful of distinct styles, so the font and fill proxies are resolved once
+# per style instead of once per cell.
+_style_flags = weakref.WeakKeyDictionary()
+
+def style_flags(cell : Cell):
+    flags = _style_flags.get(cell.parent.parent)
+    if flags is None:
+        flags = _style_flags[cell.parent.parent] = {}
+    style_id = cell.style_id
+    if style_id not in flags:
+        flags[style_id] = (bool(cell.font.bold), is_gray(cell))
+    return flags[style_id]
+
 def extract_table(start_cell : Cell, object):
     table_columns = []
     title_cell = start_cell
-    while not title_cell.font.bold:
+    while not style_flags(title_cell)[0]:
         column = []
         cell = title_cell
         while cell.value:
@@ -141,24 +220,66 @@ def add_header(object, title, link_title, date, description):
     object['description'] = escape_quotes(description)
     return object
 
-def main(filename, output_dir):
+# The templates are read from the directory of this script, whatever the
+# current directory is; the conversion cache hashes the same files.
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES = ['TestCase.mustache', 'TestSpecification.mustache', 'ExperimentSpecification.mustache']
+
+_template_tokens = {}
+
+def load_template(name):
+    # Reads and tokenizes a Mustache template once per process. chevron.render
+    # takes the token list in place of the template text and skips its own
+    # tokenizer; forked workers inherit whatever the parent already loaded.
+    path = os.path.join(TEMPLATE_DIR, name)
+    key = os.path.abspath(path)
+    tokens = _template_tokens.get(key)
+    if tokens is None:
+        with open(path, 'r') as template:
+            tokens = list(tokenize(template.read()))
+        _template_tokens[key] = tokens
+    return tokens
+
+def preload_templates():
+    # Long-running callers load the templates up front, so a missing one
+    # fails at startup (with FileNotFoundError) rather than on a workbook.
+    for name in TEMPLATES:
+        load_template(name)
+
+def load_sheets(filename, reader='openpyxl'):
+    check_reader(reader)
+    if reader == 'direct':
+        # Columns A-C hold the sections; the diagram table below the
+        # "Diagrams" row is the only place that uses further columns. Data and
+        # lookup sheets are recognized by their A1 and never parsed.
+        return xlsx_reader.read_styled_sheets(filename, LAST_ROW, max_column=3, wide_from='diagrams',
+                                              first_values=SHEET_TYPES)
+    return load_workbook(filename).worksheets
+
+def render_workbook(filename, reader='openpyxl'):
     try:
-        wb = load_workbook(filename)
+        sheets = load_sheets(filename, reader)
     except:
         print("File does not exist!")
-        return
+        return None
 
+    name = os.path.splitext(os.path.basename(filename))[0]
+    mtime = date.fromtimestamp(os.path.getmtime(filename)).isoformat()
+    return render_sheets(sheets, name, mtime)
+
+def render_sheets(sheets, name, mtime):
+    # name: the workbook file name without extension, mtime: the ISO date
+    # shown in the front matter.
     test_case = None
     test_specifications = []
     experiment_specifications = []
-    for sheet in wb:
-        sheet_ranges = wb[sheet.title]
-        sheet_type = sheet_ranges['A1']
-        if sheet_type.value == 'Test Case':
+    for sheet_ranges in sheets:
+        sheet_type = cell_value(sheet_ranges, 1, 1)
+        if sheet_type == 'Test Case':
             test_case = extract_test_case(sheet_ranges)
-        elif sheet_type.value == 'Test Specification':
+        elif sheet_type == 'Test Specification':
             test_specifications.append(extract_test_specification(sheet_ranges))
-        elif sheet_type.value == 'Experiment Specification':
+        elif sheet_type == 'Experiment Specification':
             experiment_specifications.append(extract_experiment_specification(sheet_ranges))
 
     test_specifications = [ts for ts in test_specifications if ts is not None]
@@ -167,28 +288,24 @@ def main(filename, output_dir):
     output_files = {}
 
     if test_case:
-        mtime = date.fromtimestamp(os.path.getmtime(filename)).isoformat()
-        test_case_filename = os.path.splitext(os.path.basename(filename))[0]
-        add_header(test_case, 'Test Case ' + test_case_filename, test_case_filename, mtime, test_case['name'])
-        with open('TestCase.mustache', 'r') as template:
-            md_test_case = chevron.render(template=template, data=test_case)
-            index_name = 'index.md' if len(test_specifications) == 0 else '_index.md'
-            output_files['root'] = {
-                'dir_path': os.path.join('.'), 
-                'filename': index_name,
-                'content': md_test_case
-            }
-            # print(md_test_case)
+        add_header(test_case, 'Test Case ' + name, name, mtime, test_case['name'])
+        md_test_case = chevron.render(template=load_template('TestCase.mustache'), data=test_case)
+        index_name = 'index.md' if len(test_specifications) == 0 else '_index.md'
+        output_files['root'] = {
+            'dir_path': os.path.join('.'), 
+            'filename': index_name,
+            'content': md_test_case
+        }
+        # print(md_test_case)
     
         for ts in test_specifications:
             add_header(ts, 'Test Specification ' + ts['id'], ts['id'], mtime, ts['name'])
-            with open('TestSpecification.mustache', 'r') as template:
-                md_test_spec = chevron.render(template=template, data=ts)
-                output_files[ts['id']] = {
-                    'dir_path': os.path.join('.', ts['id']),
-                    'filename': 'index.md', 
-                    'content': md_test_spec
-                }
+            md_test_spec = chevron.render(template=load_template('TestSpecification.mustache'), data=ts)
+            output_files[ts['id']] = {
+                'dir_path': os.path.join('.', ts['id']),
+                'filename': 'index.md', 
+                'content': md_test_spec
+            }
 
         for es in experiment_specifications:
             add_header(es, 'Experiment Specification ' + es['id'], es['id'], mtime, es['name'])
@@ -198,32 +315,150 @@ def main(filename, output_dir):
                 output_files[es['parent_reference']]['filename'] = '_index.md'
 
             if parent_path:
-                with open('ExperimentSpecification.mustache', 'r') as template:
-                    md_exp_spec = chevron.render(template=template, data=es)
-                    output_files[es['id']] = {
-                        'dir_path': os.path.join('.', parent_path, es['id']),
-                        'filename': 'index.md', 
-                        'content': md_exp_spec
-                    }
-
-    for of in output_files.values():
+                md_exp_spec = chevron.render(template=load_template('ExperimentSpecification.mustache'), data=es)
+                output_files[es['id']] = {
+                    'dir_path': os.path.join('.', parent_path, es['id']),
+                    'filename': 'index.md', 
+                    'content': md_exp_spec
+                }
+
+    return list(output_files.values())
+
+def workbook_to_markdown(source, name, modified=None, reader='openpyxl'):
+    # In-memory API: source is a path, a binary file-like object or the bytes
+    # of a workbook, name its file name without extension and modified the
+    # date for the front matter (default: today). Returns {relative path:
+    # Markdown}. Templates are read on first use unless preload_templates()
+    # ran before; nothing else touches the file system.
+    sheets = load_sheets(xlsx_reader.workbook_source(source), reader)
+    modified = (modified or date.today()).strftime('%Y-%m-%d')
+    return {output_path(of): of['content'] for of in render_sheets(sheets, name, modified)}
+
+def output_path(output_file):
+    return os.path.normpath(os.path.join(output_file['dir_path'], output_file['filename']))
+
+# Every output directory keeps a manifest of the files written into it, per
+# source workbook, with the SHA-256 of their contents. Unchanged files are not
+# rewritten (so their mtime survives for Hugo and rsync), and files a workbook
+# no longer produces are removed.
+MANIFEST_NAME = '.excel2md-manifest.json'
+
+def content_digest(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'r', encoding='utf-8') as fs:
+            return json.load(fs)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if manifest:
+        with open(manifest_path, 'w', encoding='utf-8') as fs:
+            json.dump(manifest, fs, indent=1, sort_keys=True)
+    elif os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+def is_unchanged(file_path, digest, manifest_digest):
+    if not os.path.exists(file_path):
+        return False
+    if manifest_digest is not None:
+        return manifest_digest == digest
+    with open(file_path, 'r', encoding='utf-8') as fs:
+        return content_digest(fs.read()) == digest
+
+def remove_output_file(output_dir, relative_path):
+    file_path = os.path.join(output_dir, relative_path)
+    if os.path.exists(file_path):
+        print('Removing stale file ' + file_path)
+        os.remove(file_path)
+    directory = os.path.dirname(file_path)
+    while os.path.abspath(directory) != os.path.abspath(output_dir) and os.path.isdir(directory) \
+            and not os.listdir(directory):
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+def remove_stale_sources(output_dir, sources):
+    # Removes everything written by workbooks that are not in sources.
+    manifest = load_manifest(output_dir)
+    for source in [s for s in manifest if s not in sources]:
+        for relative_path in manifest.pop(source):
+            remove_output_file(output_dir, relative_path)
+    save_manifest(output_dir, manifest)
+
+def write_output_files(output_files, output_dir, source=None):
+    manifest = load_manifest(output_dir) if source else {}
+    previous = manifest.get(source, {})
+    written = {}
+    for of in output_files:
         file_path = os.path.join(output_dir, of['dir_path'], of['filename'])
+        relative_path = output_path(of)
+        digest = content_digest(of['content'])
+        written[relative_path] = digest
+        if is_unchanged(file_path, digest, previous.get(relative_path)):
+            print('Keeping unchanged file ' + file_path)
+            continue
         print('Creating file ' + file_path)
         if not os.path.exists(os.path.dirname(file_path)):
             os.makedirs(os.path.dirname(file_path))
         
         with open(file_path, 'w', encoding='utf-8') as fs:
             fs.write(of['content'])
-        
+
+    if source:
+        for relative_path in previous:
+            if relative_path not in written:
+                remove_output_file(output_dir, relative_path)
+        # A workbook without pages leaves no entry, so no manifest is
+        # written into an output directory nothing was created in.
+        if written:
+            manifest[source] = written
+        else:
+            manifest.pop(source, None)
+        save_manifest(output_dir, manifest)
+
+def main(filename, output_dir, cache_dir=None, cache=None, reader='openpyxl'):
+    # With a cache directory (or a ConversionCache for 'md' opened by the
+    # caller), the rendered files are looked up by the hash of the workbook,
+    # the converter and its templates, plus the file name and modification
+    # date that end up in the front matter. Returns 1 when the workbook
+    # cannot be read, 0 otherwise. An unknown reader raises ValueError here,
+    # not as an unreadable workbook.
+    check_reader(reader)
+    output_files = None
+    if cache is None and cache_dir:
+        cache = ConversionCache(cache_dir, 'md')
+    if cache:
+        try:
+            key = cache.key(filename, os.path.basename(filename), date.fromtimestamp(os.path.getmtime(filename)).isoformat())
+        except OSError:
+            key = None
+        if key:
+            output_files = cache.load(key)
+            if output_files is not None:
+                print('Reusing cached conversion of ' + filename)
+
+    if output_files is None:
+        output_files = render_workbook(filename, reader)
+        if output_files is None:
+            return 1
+        if cache and key:
+            cache.store(key, output_files)
+
+    write_output_files(output_files, output_dir, os.path.basename(filename))
+    return 0
+
 
 #Python3
 if __name__ == '__main__':
-    output_dir = '.'
-    if len(sys.argv) > 1:
-        filename = str(sys.argv[1])
-        if len(sys.argv) > 2:
-            output_dir = str(sys.argv[2])
-    else:
-        print("No arguments introduced")
-
-    main(filename, output_dir)
+    parser = argparse.ArgumentParser(description='Convert a test case workbook to Markdown pages')
+    parser.add_argument('filename', help='workbook to convert')
+    parser.add_argument('output_dir', nargs='?', default='.', help='directory for the pages (default: .)')
+    parser.add_argument('cache_dir', nargs='?', default=None, help='conversion cache directory (default: no cache)')
+    parser.add_argument('--reader', choices=READERS, default='openpyxl',
+                        help='how worksheets are read: through openpyxl (default) or by parsing the sheet XML directly')
+    args = parser.parse_args()
+
+    sys.exit(main(args.filename, args.output_dir, args.cache_dir, reader=args.reader))
@@ -1,17 +1,129 @@
 #! /usr/bin/python3
 
+import argparse
 import datetime
+import glob
+import io
+import os
 import pyxb
 import IEC62559
+import shutil
 import sys
-import xml.dom.minidom
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
+import xlsx_reader
+
+class SheetGrid:
+  # Snapshot of a worksheet's used range as plain row tuples, read in one
+  # pass so extractors never go through Worksheet.cell() (which creates and
+  # registers a Cell object for every coordinate it is asked about).
+  def __init__(self, rows):
+    self.rows       = rows
+    self.max_row    = len(rows)
+    self.max_column = max((len(row) for row in rows), default=0)
+
+  @classmethod
+  def from_rows(cls, value_rows):
+    # Trailing empty cells are dropped, so max_column is the last column that
+    # actually holds a value rather than the sheet's declared dimension.
+    rows = []
+    for row in value_rows:
+      end = len(row)
+      while end and row[end - 1] is None:
+        end = end - 1
+      rows.append(tuple(row[:end]))
+    return cls(rows)
+
+  @classmethod
+  def from_sheet(cls, sheet, max_row=None):
+    # sheet must come from a read-only workbook: on a fully loaded one,
+    # iter_rows() goes through Worksheet.cell() for every coordinate of the
+    # declared dimension, however few of them hold a value.
+    return cls.from_rows(sheet.iter_rows(min_row=1, min_col=1, max_row=max_row, values_only=True))
+
+  def value(self, row, column):
+    if row < 1 or column < 1:
+      return None
+    try:
+      return self.rows[row - 1][column - 1]
+    except IndexError:
+      return None
 
 def cell(sheet_ranges, row, column):
-    return sheet_ranges.cell(row=row, column=column).value
+    return sheet_ranges.value(row, column)
 
 def cell_str(sheet_ranges, row, column):
-    return str(sheet_ranges.cell(row=row, column=column).value)
+    return str(sheet_ranges.value(row, column))
+
+# Layout of the IEC 62559 template. Single-valued use case attributes live in
+# column C; every entry of COLUMN_BLOCKS describes an object that repeats once
+# per column, starting at column C, until a column in which all of its
+# 'until_blank' rows are empty (or 'last_column' is passed).
+#   fields:   (attribute, row) pairs assigned as strings
+#   children: (list attribute, binding, attribute, row) single-field children
+FIRST_COLUMN = 3
+LAST_ROW     = 84
+
+USECASE_FIELDS = [
+  ('identifier',     4),
+  ('name',           6),
+  ('scope',          14),
+  ('levelOfDepth',   30),
+  ('prioritization', 31),
+  ('classification', 32),
+  ('nature',         33),
+  ('keywords',       34),
+]
+
+COLUMN_BLOCKS = [
+  {'key':         'kpis',
+   'binding':     'KeyPerformanceIndicator',
+   'fields':      [('identifier', 21), ('name', 22), ('description', 23)],
+   'children':    [('Objective', 'Ref_Objective', 'mRID', 24)],
+   'until_blank': [21, 22]},
+  {'key':         'assumptions',
+   'binding':     'Assumption',
+   'fields':      [('description', 26)],
+   'until_blank': [26]},
+  {'key':         'conditions',
+   'binding':     'Condition',
+   'fields':      [('description', 27)],
+   'until_blank': [27]},
+  {'key':         'actorgroupings',
+   'binding':     'ActorGrouping',
+   'fields':      [('name', 44), ('description', 45)],
+   'until_blank': [44, 45],
+   'last_column': 19},
+  {'key':         'actors',
+   'binding':     'Actor',
+   'fields':      [('name', 46), ('type', 47), ('description', 48)],
+   'until_blank': [46, 48],
+   'last_column': 19},
+  {'key':         'references',
+   'binding':     'Reference',
+   'fields':      [('name', 51), ('number', 52), ('type', 53), ('description', 54),
+                   ('status', 55), ('impact', 56), ('originatorOrganization', 57), ('link', 58)],
+   'until_blank': [51, 53],
+   'last_column': 19},
+  {'key':         'scenarios',
+   'binding':     'Scenario',
+   'fields':      [('number', 62), ('name', 63), ('description', 64)],
+   'children':    [('TriggeringEvent', 'TriggeringEvent', 'description', 66),
+                   ('Precondition', 'Condition', 'description', 67),
+                   ('Postcondition', 'Condition', 'description', 68)],
+   'until_blank': [62, 63, 64]},
+  {'key':         'activities',
+   'binding':     'Activity',
+   'fields':      [('number', 71), ('event', 72), ('name', 73), ('description', 74),
+                   ('service', 75), ('step_no', 79)],
+   'until_blank': [71, 73, 74]},
+  {'key':         'requirements',
+   'binding':     'Requirement',
+   'fields':      [('mRID', 81), ('identifier', 82), ('name', 83), ('description', 84)],
+   'until_blank': [82, 84]},
+]
 
 def extract_area(sheet_ranges):
   area = IEC62559.Area()
@@ -23,12 +135,12 @@ def extract_version(sheet_ranges):
   author                   = IEC62559.Author()
   try:
     version.number         = cell_str(sheet_ranges, 8, 3)
-    tdate                  = str(sheet_ranges.cell(row = 9, column = 3).value)
+    tdate                  = cell_str(sheet_ranges, 9, 3)
     tdate                  = tdate[:-9]
     version.date           = datetime.datetime.strptime(tdate, "%Y-%m-%d")
-    author.name            = str(sheet_ranges.cell(row = 10, column = 3).value)
-    version.changes        = str(sheet_ranges.cell(row = 11, column = 3).value)
-    version.approvalStatus = str(sheet_ranges.cell(row = 12, column = 3).value)
+    author.name            = cell_str(sheet_ranges, 10, 3)
+    version.changes        = cell_str(sheet_ranges, 11, 3)
+    version.approvalStatus = cell_str(sheet_ranges, 12, 3)
     version.Author.append(author)
   except Exception as e:
     print("Exception caught: " + str(e), file=sys.stderr)
@@ -51,62 +163,6 @@ def extract_narrative(sheet_ranges):
   narrative.completeDescription = cell(sheet_ranges, 19, 3)
   return narrative
 
-def extract_kpis(sheet_ranges):
-  kpi_list = []
-  column = 3
-  while True:
-    kpi               = IEC62559.KeyPerformanceIndicator()
-    try:
-      kpi.identifier  = cell_str(sheet_ranges, 21, column)
-      kpi.name        = cell_str(sheet_ranges, 22, column)
-      kpi.description = cell_str(sheet_ranges, 23, column)
-      refobj          = IEC62559.Ref_Objective()
-      refobj.mRID     = cell_str(sheet_ranges, 24, column)
-      kpi.Objective.append(refobj)
-      column          = column + 1
-
-      if kpi.name == 'None' and kpi.identifier == 'None':
-        break
-      else:
-        kpi_list.append(kpi)
-
-    except Exception as e:
-      print("Exception caught: " + str(e), file=sys.stderr)
-
-  return kpi_list
-
-def extract_assumptions(sheet_ranges):
-  assumptions = []
-  column = 3
-  while True:
-    assumption = IEC62559.Assumption()
-    try:
-      assumption.description = cell_str(sheet_ranges, 26, column)
-      if assumption.description == 'None':
-        break
-      else:
-        assumptions.append(assumption)
-      column          = column + 1
-    except Exception as e:
-      print("Exception caught: " + str(e), file=sys.stderr)
-  return assumptions
-
-def extract_conditions(sheet_ranges):
-  conditions = []
-  column = 3
-  while True:
-    condition = IEC62559.Condition()
-    try:
-      condition.description = cell_str(sheet_ranges, 27, column)
-      if condition.description == 'None':
-        break
-      else:
-        conditions.append(condition)
-      column          = column + 1
-    except Exception as e:
-      print("Exception caught: " + str(e), file=sys.stderr)
-  return conditions
-
 def extract_ref_usecase(sheet_ranges):
   refusecase                    = IEC62559.Ref_UseCase()
   refusecase.mRID               = cell(sheet_ranges, 29, 3) or 'None'
@@ -140,190 +196,155 @@ def extract_drawing(sheet_ranges):
 
   return drawing
 
-def extract_actorgroupings(sheet_ranges):
-  actorgroupings                = []
-  column                        = 3
-  while True and column < 20:
-    try:
-      actorgrouping             = IEC62559.ActorGrouping()
-      actorgrouping.name        = cell_str(sheet_ranges, 44, column)
-      actorgrouping.description = cell_str(sheet_ranges, 45, column)
-      column                    = column + 1
-      if actorgrouping.name == 'None' and actorgrouping.description == 'None':
-        break
-      else:
-        actorgroupings.append(actorgrouping)
-    except Exception as e:
-      print("Exception caught: " + str(e), file=sys.stderr)
-  return actorgroupings
-
-def extract_actors(sheet_ranges):
-  actors                        = []
-  column                        = 3
-  while True and column < 20:
-    try:
-      actor                     = IEC62559.Actor()
-      actor.name                = cell_str(sheet_ranges, 46, column)
-      actor.type                = cell_str(sheet_ranges, 47, column)
-      actor.description         = cell_str(sheet_ranges, 48, column)
-      column                    = column + 1
-      if actor.name == 'None' and actor.description == 'None':
-        break
-      else:
-        actors.append(actor)
-    except Exception as e:
-      print("Exception caught: " + str(e), file=sys.stderr)
-  return actors
-
-def extract_references(sheet_ranges):
-  references                           = []
-  column                               = 3
-  while True and column < 20:
-    try:
-      reference                        = IEC62559.Reference()
-      reference.name                   = cell_str(sheet_ranges, 51, column)
-      reference.number                 = cell_str(sheet_ranges, 52, column)
-      reference.type                   = cell_str(sheet_ranges, 53, column)
-      reference.description            = cell_str(sheet_ranges, 54, column)
-      reference.status                 = cell_str(sheet_ranges, 55, column)
-      reference.impact                 = cell_str(sheet_ranges, 56, column)
-      reference.originatorOrganization = cell_str(sheet_ranges, 57, column)
-      reference.link                   = cell_str(sheet_ranges, 58, column)
-      column                           = column + 1
-      if reference.name == 'None' and reference.type == 'None':
-        break
-      else:
-        references.append(reference)
-    except Exception as e:
-      print("Exception caught: " + str(e), file=sys.stderr)
-  return references
-
-def extract_scenarios(sheet_ranges):
-  scenarios = []
-  column = 3
-  while True:
-    scenario                    = IEC62559.Scenario()
-    try:
-      scenario.number           = cell_str(sheet_ranges, 62, column)
-      scenario.name             = cell_str(sheet_ranges, 63, column)
-      scenario.description      = cell_str(sheet_ranges, 64, column)
-      triggevent                = IEC62559.TriggeringEvent()
-      triggevent.description    = cell_str(sheet_ranges, 66, column)
-      precondition              = IEC62559.Condition()
-      precondition.description  = cell_str(sheet_ranges, 67, column)
-      postcondition             = IEC62559.Condition()
-      postcondition.description = cell_str(sheet_ranges, 68, column)
-      scenario.TriggeringEvent.append(triggevent)
-      scenario.Precondition.append(precondition)
-      scenario.Postcondition.append(postcondition)
-
-      if scenario.name == 'None' and scenario.description == 'None' and scenario.number == 'None':
-        break
-      else:
-        scenarios.append(scenario)
-      column          = column + 1
-    except Exception as e:
-      print("Exception caught: " + str(e), file=sys.stderr)
-  return scenarios
-
-def extract_activities(sheet_ranges):
-  activities = []
-  column = 3
-  while True:
-    activity       = IEC62559.Activity()
-    try:
-      activity.number      = cell_str(sheet_ranges, 71, column)
-      activity.event       = cell_str(sheet_ranges, 72, column)
-      activity.name        = cell_str(sheet_ranges, 73, column)
-      activity.description = cell_str(sheet_ranges, 74, column)
-      activity.service     = cell_str(sheet_ranges, 75, column)
-      activity.step_no     = cell_str(sheet_ranges, 79, column)
-      column               = column + 1
-
-      if activity.description == 'None' and activity.name == 'None' and activity.number == 'None':
-        break
-      else:
-        activities.append(activity)
-    except Exception as e:
-      print("Exception caught: " + str(e), file=sys.stderr)
-  return activities
-
 def match_activities_to_scenarios(activities, scenarios):
+  scenarios_by_number = {}
+  for scenario in scenarios:
+    scenarios_by_number.setdefault(scenario.number, []).append(scenario)
+  unmatched = []
   for activity in activities:
-    for scenario in scenarios:
-      if scenario.number == activity.step_no:
-        scenario.Activity.append(activity)
-
-def extract_requirements(sheet_ranges):
-  requirements = []
-  column = 3
-  while True:
-    requirement = IEC62559.Requirement()
-    try:
-      requirement.mRID        = cell_str(sheet_ranges, 81, column)
-      requirement.identifier  = cell_str(sheet_ranges, 82, column)
-      requirement.name        = cell_str(sheet_ranges, 83, column)
-      requirement.description = cell_str(sheet_ranges, 84, column)
-      column                  = column + 1
-
-      if requirement.description == 'None' and requirement.identifier == 'None':
-        break
-      else:
-        requirements.append(requirement)
-    except Exception as e:
-      print("Exception caught: " + str(e), file=sys.stderr)
-  return requirements
-
-def extract_usecase(sheet_ranges):
-  column = 3
+    matches = scenarios_by_number.get(activity.step_no)
+    if not matches:
+      unmatched.append(activity)
+      print("Activity " + str(activity.number) + " refers to unknown scenario " + str(activity.step_no), file=sys.stderr)
+      continue
+    for scenario in matches:
+      scenario.Activity.append(activity)
+  return unmatched
+
+def bind_column(sheet_ranges, block, column):
+  obj = getattr(IEC62559, block['binding'])()
+  for attribute, row in block['fields']:
+    setattr(obj, attribute, cell_str(sheet_ranges, row, column))
+  for attribute, binding, child_attribute, row in block.get('children', []):
+    child = getattr(IEC62559, binding)()
+    setattr(child, child_attribute, cell_str(sheet_ranges, row, column))
+    getattr(obj, attribute).append(child)
+  return obj
+
+def sweep_columns(sheet_ranges, blocks=COLUMN_BLOCKS, errors=None):
+  # Walks the columns of the used range once, building the objects of every
+  # block that is still open in that column. A column whose values cannot be
+  # bound is recorded in errors as (key, column letter, message) and skipped.
+  columns = {block['key']: [] for block in blocks}
+  active  = list(blocks)
+  for column in range(FIRST_COLUMN, sheet_ranges.max_column + 1):
+    if not active:
+      break
+    for block in list(active):
+      if column > block.get('last_column', column) or \
+         all(cell(sheet_ranges, row, column) is None for row in block['until_blank']):
+        active.remove(block)
+        continue
+      try:
+        columns[block['key']].append(bind_column(sheet_ranges, block, column))
+      except Exception as e:
+        print("Skipping column " + get_column_letter(column) + " of " + block['key'] + ": " + str(e), file=sys.stderr)
+        if errors is not None:
+          errors.append((block['key'], get_column_letter(column), str(e)))
+  return columns
+
+def extract_usecase(sheet_ranges, columns):
   usecase                       = IEC62559.UseCase()
-  usecase.identifier            = cell(sheet_ranges, 4, column)
-  usecase.name                  = cell(sheet_ranges, 6, column)
-  usecase.scope                 = cell(sheet_ranges, 14, column)
+  for attribute, row in USECASE_FIELDS:
+    setattr(usecase, attribute, cell(sheet_ranges, row, FIRST_COLUMN))
   usecase.RelatedObjective.append(extract_relobj(sheet_ranges))
   usecase.BusinessCase.append(extract_bcase(sheet_ranges))
   usecase.Narrative             = extract_narrative(sheet_ranges)
   usecase.RelatedUseCase.append(extract_ref_usecase(sheet_ranges))
-  usecase.levelOfDepth          = cell(sheet_ranges, 30, column)
-  usecase.prioritization        = cell(sheet_ranges, 31, column)
-  usecase.classification        = cell(sheet_ranges, 32, column)
-  usecase.nature                = cell(sheet_ranges, 33, column)
-  usecase.keywords              = cell(sheet_ranges, 34, column)
   usecase.Version.append(extract_version(sheet_ranges))
-  if extract_drawing(sheet_ranges) != None:
+  drawing                       = extract_drawing(sheet_ranges)
+  if drawing is not None:
     usecase.Drawing.append(drawing)
-  for kpi in extract_kpis(sheet_ranges):
+  for kpi in columns['kpis']:
     usecase.KeyPerformanceIndicator.append(kpi)
-  for assumption in extract_assumptions(sheet_ranges):
+  for assumption in columns['assumptions']:
     usecase.Assumption.append(assumption)
-  for condition in extract_conditions(sheet_ranges):
+  for condition in columns['conditions']:
     usecase.Prerequisite.append(condition)
   usecase.Remark.append(extract_remark(sheet_ranges))
-  for actorgrouping in extract_actorgroupings(sheet_ranges):
-    usecase.append(actorgrouping)
-  for reference in extract_references(sheet_ranges):
+  for actorgrouping in columns['actorgroupings']:
+    usecase.ActorGrouping.append(actorgrouping)
+  for reference in columns['references']:
     usecase.Reference.append(reference)
-  scenarios = extract_scenarios(sheet_ranges)
-  for scenario in scenarios:
+  for scenario in columns['scenarios']:
     usecase.Scenario.append(scenario)
-  activities = extract_activities(sheet_ranges)
-  match_activities_to_scenarios(activities, scenarios)
+  match_activities_to_scenarios(columns['activities'], columns['scenarios'])
   return usecase
 
-def main():
-
-  if len(sys.argv) > 1:
-    filename = str(sys.argv[1])
-  else:
-    print("No arguments introduced")
-
+# Backends that read the template rows of a sheet. 'direct' parses the
+# worksheet XML itself (see xlsx_reader) and yields the same values as
+# openpyxl, without building openpyxl's workbook model.
+READERS = ['openpyxl', 'direct']
+
+def load_sheet_grid(filename, sheet_index=0, max_row=LAST_ROW, reader='openpyxl'):
+  if reader == 'direct':
+    return SheetGrid.from_rows(xlsx_reader.read_rows(filename, sheet_index, max_row))
+  # In read-only mode openpyxl streams the worksheet XML on demand instead of
+  # building the whole workbook, so only the converted sheet is ever parsed,
+  # and only down to the last row of the template.
+  wb = load_workbook(filename, read_only=True)
   try:
-    wb = load_workbook(filename)
-  except:
-    print("File does not exist!")
-    pass
-
-  sheet_list = wb.sheetnames
+    return SheetGrid.from_sheet(wb.worksheets[sheet_index], max_row)
+  finally:
+    wb.close()
+
+def load_sheet_grids(filename, max_row=LAST_ROW, reader='openpyxl'):
+  # Every sheet in turn, all read from one open workbook.
+  if reader == 'direct':
+    for rows in xlsx_reader.iter_sheet_rows(filename, max_row):
+      yield SheetGrid.from_rows(rows)
+    return
+  wb = load_workbook(filename, read_only=True)
+  try:
+    for sheet in wb.worksheets:
+      yield SheetGrid.from_sheet(sheet, max_row)
+  finally:
+    wb.close()
+
+def count_sheets(filename, reader='openpyxl'):
+  if reader == 'direct':
+    return xlsx_reader.sheet_count(filename)
+  wb = load_workbook(filename, read_only=True)
+  sheet_count = len(wb.worksheets)
+  wb.close()
+  return sheet_count
+
+def extract_grid(sheet_ranges):
+  # Returns the bindings of one sheet, which are plain picklable objects.
+  # Sheets without a use case identifier are auxiliary sheets and yield None.
+  if cell(sheet_ranges, 4, FIRST_COLUMN) is None:
+    return None
+  errors  = []
+  columns = sweep_columns(sheet_ranges, errors=errors)
+  return {
+    'usecase':      extract_usecase(sheet_ranges, columns),
+    'area':         extract_area(sheet_ranges),
+    'actors':       columns['actors'],
+    'requirements': columns['requirements'],
+    'errors':       errors,
+  }
+
+def extract_sheet(filename, sheet_index, reader='openpyxl'):
+  # Runs in a worker process: opens the workbook for its one sheet.
+  return extract_grid(load_sheet_grid(filename, sheet_index, reader=reader))
+
+def iter_workbook(filename, pool=None, reader='openpyxl'):
+  # Without a pool, or for a single sheet, the workbook is opened once and
+  # its sheets are extracted as they are read; with one, every worker opens
+  # the workbook for its own sheet.
+  sheets = None
+  if pool is not None:
+    sheet_count = count_sheets(filename, reader)
+    if sheet_count >= 2:
+      sheets = pool.map(extract_sheet, [filename] * sheet_count, range(sheet_count), [reader] * sheet_count)
+  if sheets is None:
+    sheets = map(extract_grid, load_sheet_grids(filename, reader=reader))
+  return (sheet for sheet in sheets if sheet is not None)
+
+def extract_workbook(filename, pool=None, reader='openpyxl'):
+  return list(iter_workbook(filename, pool, reader))
+
+def build_repository(sheets):
   usecaserep    = IEC62559.UseCaseRepository()
   usecaselib    = IEC62559.UseCaseLibrary()
   arealib       = IEC62559.AreaLibrary()
@@ -331,19 +352,15 @@ def main():
   reqlib        = IEC62559.RequirementLibrary()
   reqcat        = IEC62559.RequirementCategory()
 
-  usecase = None
-  for sheet in wb:
-    sheet_ranges = wb[sheet.title]
-    usecase = extract_usecase(sheet_ranges)
-    arealib.Area.append(extract_area(sheet_ranges))
-    usecaserep.AreaLibrary = arealib
-    for actor in extract_actors(sheet_ranges):
-      actorlib.append(actor)
-    for requirement in extract_requirements(sheet_ranges):
+  for sheet in sheets:
+    usecaselib.UseCase.append(sheet['usecase'])
+    arealib.Area.append(sheet['area'])
+    for actor in sheet['actors']:
+      actorlib.Actor.append(actor)
+    for requirement in sheet['requirements']:
       reqcat.Requirement.append(requirement)
-    break
 
-  usecaselib.UseCase.append(usecase)
+  usecaserep.AreaLibrary = arealib
   usecaselib.name = "UCL_name"
   usecaserep.UseCaseLibrary = usecaselib
   usecaserep.name = "UCR_name"
@@ -351,10 +368,355 @@ def main():
 
   reqcat.name = "Req_Name" #sustituir por cell
   reqcat.identifier = "Req_ID"  #sustituir por cell
-  reqlib.append(reqcat)
+  reqlib.RequirementCategory.append(reqcat)
   usecaserep.RequirementLibrary = reqlib
+  return usecaserep
+
+def set_binding_validation(enabled):
+  # PyXB checks every assignment and append against the schema while
+  # forBinding is set; turning it off leaves checking to collect_violations().
+  pyxb.RequireValidWhenParsing(enabled)
+
+# What the extractors do with an object the schema rejects one of the values
+# of (see extract_version, extract_remark, extract_drawing and sweep_columns):
+# leave it out (None) or put an empty object of the named binding in its place.
+# All of these elements repeat in the schema.
+RECOVERED_ELEMENTS = {
+  'Version':                 'Version',
+  'Remark':                  'Remark',
+  'Drawing':                 None,
+  'KeyPerformanceIndicator': None,
+  'Assumption':              None,
+  'Prerequisite':            None,
+  'ActorGrouping':           None,
+  'Actor':                   None,
+  'Reference':               None,
+  'Scenario':                None,
+  'Activity':                None,
+  'Requirement':             None,
+}
+
+def child_elements(instance, path):
+  # (element use, child, path of the child) for every element of instance.
+  for eu in instance._ElementMap.values():
+    value = eu.value(instance)
+    if value is None:
+      continue
+    values = value if eu.isPlural() else [value]
+    for index, child in enumerate(list(values), 1):
+      child_path = path + '/' + eu.name().localName()
+      if eu.isPlural():
+        child_path = child_path + '[' + str(index) + ']'
+      yield eu, child, child_path
+
+def value_violations(instance, path, violations):
+  # The values and attributes anywhere below instance that the schema
+  # rejects; unlike its content model, these are checked on assignment.
+  try:
+    instance._validateAttributes()
+    if instance._ContentTypeTag == instance._CT_SIMPLE:
+      instance._validatedChildren()
+  except pyxb.PyXBException as e:
+    violations.append((path, e))
+  for eu, child, child_path in child_elements(instance, path):
+    if isinstance(child, pyxb.binding.basis.complexTypeDefinition):
+      value_violations(child, child_path, violations)
+      continue
+    try:
+      eu.elementBinding().compatibleValue(child)
+    except pyxb.PyXBException as e:
+      violations.append((child_path, e))
+  return violations
+
+def recover_invalid_values(instance, path='UseCaseRepository', recovered=None):
+  # Applies the recovery of RECOVERED_ELEMENTS to a tree built without
+  # per-assignment validation, so that deferred validation converts the
+  # same workbooks as validation while extracting. Returns (path, replaced,
+  # violations) for every object that was left out or emptied.
+  if recovered is None:
+    recovered = []
+  for eu, child, child_path in child_elements(instance, path):
+    if not isinstance(child, pyxb.binding.basis.complexTypeDefinition):
+      continue
+    name = eu.name().localName()
+    violations = value_violations(child, child_path, []) if name in RECOVERED_ELEMENTS else []
+    if not violations:
+      recover_invalid_values(child, child_path, recovered)
+      continue
+    values   = eu.value(instance)
+    position = next(i for i, value in enumerate(values) if value is child)
+    if RECOVERED_ELEMENTS[name] is None:
+      del values[position]
+    else:
+      values[position] = getattr(IEC62559, RECOVERED_ELEMENTS[name])()
+    recovered.append((child_path, RECOVERED_ELEMENTS[name] is not None, violations))
+  return recovered
+
+def error_message(e):
+  # str() of a PyXB validation error is a tuple of object reprs; details()
+  # names the element and the content the schema expected instead.
+  if isinstance(e, pyxb.ValidationError):
+    return e.details()
+  return str(e)
+
+def collect_violations(instance, path='UseCaseRepository', violations=None):
+  # Validates a tree built without per-assignment validation and returns every
+  # (path, error) found instead of stopping at the first one. Simple values are
+  # checked one by one; the content model of a node is only checked once its
+  # own values are valid, since PyXB would otherwise report the same value again.
+  if violations is None:
+    violations = []
+  values_ok = True
+  for eu, child, child_path in child_elements(instance, path):
+    if isinstance(child, pyxb.binding.basis.complexTypeDefinition):
+      collect_violations(child, child_path, violations)
+      continue
+    try:
+      eu.elementBinding().compatibleValue(child)
+    except pyxb.PyXBException as e:
+      violations.append((child_path, e))
+      values_ok = False
+  if values_ok:
+    try:
+      instance._validatedChildren()
+      instance._validateAttributes()
+    except pyxb.PyXBException as e:
+      violations.append((path, e))
+  return violations
+
+def write_repository(usecaserep, fh):
+  # Writes the DOM PyXB builds straight to fh with the same layout as
+  # minidom's toprettyxml(), without serializing and re-parsing it first.
+  dom = usecaserep.toDOM(element_name='UseCaseRepository')
+  # Drops the empty text nodes PyXB emits for empty simple content, which a
+  # parser would never have produced.
+  dom.normalize()
+  dom.writexml(fh, '', '\t', '\n')
+  fh.write('\n')
+  dom.unlink()
+
+def repository_to_xml(usecaserep):
+  fh = io.StringIO()
+  write_repository(usecaserep, fh)
+  return fh.getvalue().encode('utf-8')
+
+# In-memory API: source is a path, a binary file-like object or the bytes of
+# a workbook. Nothing is written anywhere; columns that cannot be converted
+# are reported on stderr and left out, as by the command line.
+def workbook_to_repository(source, reader='openpyxl'):
+  return build_repository(extract_workbook(xlsx_reader.workbook_source(source), reader=reader))
+
+def workbook_to_xml(source, reader='openpyxl'):
+  return repository_to_xml(workbook_to_repository(source, reader))
+
+# Where the fragments of each library go in the XML of an empty repository:
+# (part, element written while the library is empty, closing tag the
+# fragments precede, indentation of the fragments).
+LIBRARY_SLOTS = [
+  ('actors',       '\t<ActorLibrary/>\n', '\t</ActorLibrary>\n',         '\t\t'),
+  ('areas',        '\t<AreaLibrary/>\n',  '\t</AreaLibrary>\n',          '\t\t'),
+  ('requirements', None,                  '\t\t</RequirementCategory>\n', '\t\t\t'),
+  ('usecases',     None,                  '\t</UseCaseLibrary>\n',       '\t\t'),
+]
+
+class RepositoryWriter:
+  # Writes the repository build_repository() and write_repository() would
+  # produce for any number of sheets without holding them: serialize() turns
+  # the use case, area, actors and requirements of a sheet into XML
+  # fragments, add() appends them to a temporary spool per library, and
+  # close() writes the repository around the spools. The libraries precede
+  # the use cases in the schema, so the use cases cannot go to fh directly.
+  def __init__(self, fh):
+    self.fh     = fh
+    self.spools = {part: tempfile.TemporaryFile('w+', encoding='utf-8') for part, _, _, _ in LIBRARY_SLOTS}
+    self.indent = {part: indent for part, _, _, indent in LIBRARY_SLOTS}
+    self.count  = 0
+
+  def fragment(self, part, element_name, obj):
+    # toDOM() checks the content model, so this is where an invalid sheet fails.
+    dom = obj.toDOM(element_name=element_name)
+    dom.normalize()
+    fragment = io.StringIO()
+    dom.documentElement.writexml(fragment, self.indent[part], '\t', '\n')
+    dom.unlink()
+    return part, fragment.getvalue()
+
+  def serialize(self, sheet):
+    fragments = [self.fragment('usecases', 'UseCase', sheet['usecase']),
+                 self.fragment('areas', 'Area', sheet['area'])]
+    for actor in sheet['actors']:
+      fragments.append(self.fragment('actors', 'Actor', actor))
+    for requirement in sheet['requirements']:
+      fragments.append(self.fragment('requirements', 'Requirement', requirement))
+    return fragments
+
+  def add(self, fragments):
+    for part, fragment in fragments:
+      self.spools[part].write(fragment)
+    self.count = self.count + 1
+
+  def close(self):
+    skeleton = repository_to_xml(build_repository([])).decode('utf-8')
+    position = 0
+    for part, empty, closing, _ in LIBRARY_SLOTS:
+      spool = self.spools[part]
+      if spool.tell() == 0:
+        continue
+      if empty is not None:
+        start = skeleton.index(empty, position)
+        self.fh.write(skeleton[position:start] + empty.replace('/>', '>'))
+        position = start + len(empty)
+      else:
+        start = skeleton.index(closing, position)
+        self.fh.write(skeleton[position:start])
+        position = start
+      spool.seek(0)
+      shutil.copyfileobj(spool, self.fh)
+      if empty is not None:
+        self.fh.write(closing)
+    self.fh.write(skeleton[position:])
+    self.discard()
+
+  def discard(self):
+    for spool in self.spools.values():
+      spool.close()
+
+def convert_aggregate(filenames, fh, pool=None, reader='openpyxl'):
+  # One repository for all workbooks, written with memory bounded by the
+  # largest workbook however many there are. A workbook that fails is
+  # reported and left out: its sheets are only added to the spools once all
+  # of them have been serialized.
+  failed = 0
+  writer = RepositoryWriter(fh)
+  try:
+    for filename in filenames:
+      try:
+        fragments = []
+        for sheet in iter_workbook(filename, pool, reader):
+          if sheet['errors']:
+            print(filename + ": skipped " + str(len(sheet['errors'])) + " columns that could not be converted", file=sys.stderr)
+          fragments.append(writer.serialize(sheet))
+      except FileNotFoundError:
+        print("File does not exist: " + filename, file=sys.stderr)
+        failed = failed + 1
+        continue
+      except Exception as e:
+        print("Conversion of " + filename + " failed: " + error_message(e), file=sys.stderr)
+        failed = failed + 1
+        continue
+      for sheet_fragments in fragments:
+        writer.add(sheet_fragments)
+    writer.close()
+  except BaseException:
+    writer.discard()
+    raise
+  print("Wrote " + str(writer.count) + " use cases", file=sys.stderr)
+  return failed
+
+def expand_inputs(inputs):
+  # Accepts workbook paths, glob patterns and '-' for paths read from stdin.
+  for pattern in inputs:
+    if pattern == '-':
+      for line in sys.stdin:
+        if line.strip():
+          yield line.strip()
+    elif any(c in pattern for c in '*?['):
+      yield from sorted(glob.glob(pattern, recursive=True))
+    else:
+      yield pattern
 
-  print(xml.dom.minidom.parseString(usecaserep.toxml("utf-8", element_name='UseCaseRepository').decode('utf-8')).toprettyxml())
+def output_filename(filename, output_dir):
+  stem = os.path.splitext(os.path.basename(filename))[0]
+  return os.path.join(output_dir or os.path.dirname(filename), stem + '.xml')
+
+def convert_all(filenames, output_dir, pool=None, deferred_validation=False, reader='openpyxl'):
+  # With a single input and no output directory the XML goes to stdout, as
+  # it always has; otherwise every workbook gets its own <name>.xml.
+  failed = 0
+  for filename in filenames:
+    try:
+      set_binding_validation(not deferred_validation)
+      sheets = extract_workbook(filename, pool, reader)
+      skipped = sum(len(sheet['errors']) for sheet in sheets)
+      if skipped:
+        print(filename + ": skipped " + str(skipped) + " columns that could not be converted", file=sys.stderr)
+      usecaserep = build_repository(sheets)
+      set_binding_validation(True)
+      if deferred_validation:
+        for path, replaced, violations in recover_invalid_values(usecaserep):
+          for violation_path, e in violations:
+            print(filename + ": " + violation_path + ": " + error_message(e), file=sys.stderr)
+          print(filename + ": " + ("emptied " if replaced else "left out ") + path, file=sys.stderr)
+        violations = collect_violations(usecaserep)
+        if violations:
+          for path, e in violations:
+            print(filename + ": " + path + ": " + error_message(e), file=sys.stderr)
+          print("Conversion of " + filename + " failed: " + str(len(violations)) + " schema violations", file=sys.stderr)
+          failed = failed + 1
+          continue
+      # toDOM() checks the content model of every node, so the XML is only
+      # written out once the whole repository has serialized.
+      xml = io.StringIO()
+      write_repository(usecaserep, xml)
+    except FileNotFoundError:
+      print("File does not exist: " + filename, file=sys.stderr)
+      failed = failed + 1
+      continue
+    except Exception as e:
+      print("Conversion of " + filename + " failed: " + error_message(e), file=sys.stderr)
+      failed = failed + 1
+      continue
+    if len(filenames) == 1 and output_dir is None:
+      sys.stdout.write(xml.getvalue())
+    else:
+      with open(output_filename(filename, output_dir), 'w', encoding='utf-8') as fh:
+        fh.write(xml.getvalue())
+  set_binding_validation(True)
+  return failed
+
+def main():
+  parser = argparse.ArgumentParser(description='Convert IEC 62559 use case workbooks to XML')
+  parser.add_argument('inputs', nargs='+',
+                      help='workbooks with one use case per sheet, glob patterns, or - to read paths from stdin')
+  parser.add_argument('-o', '--output-dir', default=None,
+                      help='directory for the <workbook>.xml files (default: next to each workbook)')
+  parser.add_argument('-j', '--jobs', type=int, default=None,
+                      help='worker processes used to extract the sheets (default: one per CPU, 1 disables the pool)')
+  parser.add_argument('--deferred-validation', action='store_true',
+                      help='skip schema checks while the repository is built and validate it once at the end: objects with invalid values are left out or emptied as without this flag, and every other violation is reported')
+  parser.add_argument('--reader', choices=READERS, default='openpyxl',
+                      help='how worksheets are read: through openpyxl (default) or by parsing the sheet XML directly')
+  parser.add_argument('--aggregate', metavar='FILE', default=None,
+                      help='write a single repository with the use cases of all workbooks to FILE (- for stdout), streaming them as they are extracted')
+  args = parser.parse_args()
+  if args.aggregate is not None and args.deferred_validation:
+    parser.error('--aggregate validates every use case as it is written and cannot be combined with --deferred-validation')
+
+  filenames = list(expand_inputs(args.inputs))
+  if args.output_dir is not None:
+    os.makedirs(args.output_dir, exist_ok=True)
+
+  if args.aggregate is not None:
+    fh = sys.stdout if args.aggregate == '-' else open(args.aggregate, 'w', encoding='utf-8')
+    try:
+      if args.jobs == 1:
+        failed = convert_aggregate(filenames, fh, reader=args.reader)
+      else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+          failed = convert_aggregate(filenames, fh, pool, args.reader)
+    finally:
+      if fh is not sys.stdout:
+        fh.close()
+  elif args.jobs == 1:
+    failed = convert_all(filenames, args.output_dir, deferred_validation=args.deferred_validation,
+                         reader=args.reader)
+  else:
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=set_binding_validation,
+                             initargs=(not args.deferred_validation,)) as pool:
+      failed = convert_all(filenames, args.output_dir, pool, args.deferred_validation, args.reader)
+  if failed:
+    sys.exit(1)
 
 #Python3
-main()
+if __name__ == '__main__':
+  main()
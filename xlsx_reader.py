@@ -0,0 +1,407 @@
+#! /usr/bin/python3
+
+# Direct reader for the cell values of one worksheet of an .xlsx package.
+#
+# load_workbook() parses the whole stylesheet, the defined names and the
+# dimensions of every sheet before a single value is read. The converters only
+# need plain values from the first rows of one sheet, so this reader opens the
+# zip itself, reads the shared strings and the number formats of styles.xml,
+# and iterparses the worksheet XML only down to the last requested row.
+#
+# Values come out exactly as openpyxl's read-only mode returns them with
+# values_only=True: formulas as "=..." strings, date-formatted numbers as
+# datetimes, rows cut to the dimension declared by the sheet and missing rows
+# as empty tuples.
+#
+# read_styled_sheets() serves xlsx2md, which also needs two style facts per
+# cell: whether its font is bold and whether its fill has a theme color. The
+# fonts, fills and cell formats of styles.xml are reduced to those two flags
+# once, and each sheet is kept as (value, flags) pairs the way a fully loaded
+# openpyxl worksheet reports them, merged cells included.
+
+import io
+import warnings
+import zipfile
+
+from openpyxl.formula.translate import Translator
+from openpyxl.packaging.manifest import Manifest
+from openpyxl.packaging.relationship import get_dependents, get_rels_path
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.cell import coordinate_to_tuple, range_boundaries
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, WINDOWS_EPOCH, from_excel, from_ISO8601
+from openpyxl.worksheet.formula import ArrayFormula, DataTableFormula
+from openpyxl.xml.constants import (ARC_CONTENT_TYPES, ARC_STYLE, ARC_WORKBOOK, REL_NS, SHARED_STRINGS,
+                                    SHEET_MAIN_NS, XLSM, XLSX, XLTM, XLTX)
+from openpyxl.xml.functions import fromstring, iterparse
+
+def _tag(name):
+    return '{%s}%s' % (SHEET_MAIN_NS, name)
+
+SI_TAG        = _tag('si')
+T_TAG         = _tag('t')
+R_TAG         = _tag('r')
+ROW_TAG       = _tag('row')
+VALUE_TAG     = _tag('v')
+FORMULA_TAG   = _tag('f')
+INLINE_STRING = _tag('is')
+DIMENSION_TAG = _tag('dimension')
+MERGE_TAG     = _tag('mergeCell')
+SHEET_ID      = '{%s}id' % REL_NS
+
+def text_content(node):
+    # The plain <t> of a string item followed by the <t> of its rich text
+    # runs; phonetic runs are not part of the value.
+    plain = None
+    runs  = []
+    for child in node:
+        if child.tag == T_TAG:
+            plain = child.text
+        elif child.tag == R_TAG:
+            text = None
+            for run_child in child:
+                if run_child.tag == T_TAG:
+                    text = run_child.text
+            if text is not None:
+                runs.append(text)
+    if plain is not None:
+        runs.insert(0, plain)
+    return ''.join(runs)
+
+def read_shared_strings(archive, manifest):
+    strings = []
+    part = manifest.find(SHARED_STRINGS)
+    if part is None:
+        return strings
+    with archive.open(part.PartName[1:]) as src:
+        for _, node in iterparse(src):
+            if node.tag == SI_TAG:
+                strings.append(text_content(node).replace('x005F_', ''))
+                node.clear()
+    return strings
+
+def read_number_formats(archive):
+    # Indexes of the cell formats (the s attribute of a cell) that turn a
+    # number into a date or a time span.
+    date_formats      = set()
+    timedelta_formats = set()
+    try:
+        root = fromstring(archive.read(ARC_STYLE))
+    except KeyError:
+        return date_formats, timedelta_formats
+    custom = {}
+    num_fmts = root.find(_tag('numFmts'))
+    if num_fmts is not None:
+        for num_fmt in num_fmts.findall(_tag('numFmt')):
+            custom[int(num_fmt.get('numFmtId'))] = num_fmt.get('formatCode')
+    cell_xfs = root.find(_tag('cellXfs'))
+    if cell_xfs is not None:
+        for index, xf in enumerate(cell_xfs.findall(_tag('xf'))):
+            num_fmt_id = int(xf.get('numFmtId', 0))
+            fmt = custom[num_fmt_id] if num_fmt_id in custom else builtin_format_code(num_fmt_id)
+            if is_date_format(fmt):
+                date_formats.add(index)
+            if is_timedelta_format(fmt):
+                timedelta_formats.add(index)
+    return date_formats, timedelta_formats
+
+def _is_true(value):
+    # Boolean attribute the way openpyxl's Bool descriptor reads it.
+    return value not in ('false', 'f', '0', '')
+
+def read_style_flags(archive):
+    # (bold, theme-colored fill) for every cell format index, plus the flags of
+    # cells that have no format of their own (missing and merged cells use the
+    # first font and fill).
+    try:
+        root = fromstring(archive.read(ARC_STYLE))
+    except KeyError:
+        return [(False, False)], (False, False)
+    fonts = []
+    for font in root.iterfind('%s/%s' % (_tag('fonts'), _tag('font'))):
+        bold = font.find(_tag('b'))
+        fonts.append(bold is not None and _is_true(bold.get('val', True)))
+    fills = []
+    for fill in root.iterfind('%s/%s' % (_tag('fills'), _tag('fill'))):
+        pattern = fill.find(_tag('patternFill'))
+        color = pattern.find(_tag('fgColor')) if pattern is not None else None
+        fills.append(color is not None and color.get('indexed') is None and color.get('theme') is not None)
+    cell_xfs = root.find(_tag('cellXfs'))
+    if cell_xfs is None or not len(cell_xfs):
+        return [(False, False)], (False, False)
+
+    def flags(font_id, fill_id):
+        return (font_id < len(fonts) and fonts[font_id], fill_id < len(fills) and fills[fill_id])
+
+    styles = [flags(int(xf.get('fontId', 0)), int(xf.get('fillId', 0))) for xf in cell_xfs.findall(_tag('xf'))]
+    return styles, flags(0, 0)
+
+class StyledSheet:
+    # Values and style flags of the cells of one worksheet that were kept.
+
+    def __init__(self, title, default_flags):
+        self.title         = title
+        self.cells         = {}
+        self.default_flags = default_flags
+        self.max_row       = 1
+
+    def value(self, row, column):
+        cell = self.cells.get((row, column))
+        return cell[0] if cell is not None else None
+
+    def flags(self, row, column):
+        cell = self.cells.get((row, column))
+        return cell[1] if cell is not None else self.default_flags
+
+WORKBOOK_TYPES = [XLTM, XLTX, XLSM, XLSX]
+
+def workbook_part_name(manifest):
+    # The workbook part as load_workbook finds it: the part with a workbook
+    # content type, or xl/workbook.xml when a workbook type is only declared
+    # as a default (some applications reassign the one for application/xml).
+    for content_type in WORKBOOK_TYPES:
+        part = manifest.find(content_type)
+        if part:
+            return part.PartName[1:]
+    if {default.ContentType for default in manifest.Default} & set(WORKBOOK_TYPES):
+        return ARC_WORKBOOK
+    raise IOError('File contains no valid workbook part')
+
+class Package:
+    # The parts of an open .xlsx archive needed to read worksheet values.
+
+    def __init__(self, archive):
+        self.archive  = archive
+        self.manifest = Manifest.from_tree(fromstring(archive.read(ARC_CONTENT_TYPES)))
+        workbook_part = workbook_part_name(self.manifest)
+        root = fromstring(archive.read(workbook_part))
+
+        self.epoch = WINDOWS_EPOCH
+        properties = root.find(_tag('workbookPr'))
+        if properties is not None and properties.get('date1904') not in (None, 'false', 'f', '0'):
+            self.epoch = CALENDAR_MAC_1904
+
+        # Same selection as load_workbook: sheets without a relationship id,
+        # missing parts and chartsheets are left out.
+        rels = get_dependents(archive, get_rels_path(workbook_part)).to_dict()
+        names = set(archive.namelist())
+        self.worksheets = []
+        sheets = root.find(_tag('sheets'))
+        for sheet in sheets.findall(_tag('sheet')) if sheets is not None else []:
+            if not sheet.get(SHEET_ID):
+                continue
+            rel = rels[sheet.get(SHEET_ID)]
+            if rel.target not in names or 'chartsheet' in rel.Type:
+                continue
+            self.worksheets.append((sheet.get('name'), rel.target))
+        self._shared_strings = None
+        self._style_flags    = None
+
+    def parser(self):
+        if self._shared_strings is None:
+            self._shared_strings = read_shared_strings(self.archive, self.manifest)
+            self._number_formats = read_number_formats(self.archive)
+        return WorksheetParser(self._shared_strings, self.epoch, *self._number_formats)
+
+    def iter_values(self, sheet_index=0, max_row=None):
+        with self.archive.open(self.worksheets[sheet_index][1]) as src:
+            yield from self.parser().iter_values(src, max_row)
+
+    def first_value(self, sheet_index):
+        # The value of A1, reading no further into the sheet than its first row.
+        parser = self.parser()
+        with self.archive.open(self.worksheets[sheet_index][1]) as src:
+            for _, element in iterparse(src):
+                if element.tag == ROW_TAG:
+                    for row, column, value, _ in parser.parse_row(element, parser.row_index(element, 0)):
+                        if (row, column) == (1, 1):
+                            return value
+                    return None
+        return None
+
+    def read_styled_sheet(self, sheet_index, max_row=None, max_column=None, wide_from=None):
+        # Keeps the cells of rows 1..max_row in columns 1..max_column and, from
+        # the first row whose column A reads wide_from (case-insensitive), all
+        # columns. max_row of the result still counts every cell of the sheet.
+        if self._style_flags is None:
+            self._style_flags = read_style_flags(self.archive)
+        styles, default_flags = self._style_flags
+        title, path = self.worksheets[sheet_index]
+        sheet  = StyledSheet(title, default_flags)
+        parser = self.parser()
+        wide   = False
+        row_index = 0
+        with self.archive.open(path) as src:
+            for _, element in iterparse(src):
+                if element.tag == ROW_TAG:
+                    row_index = parser.row_index(element, row_index)
+                    if max_row is not None and row_index > max_row:
+                        if len(element):
+                            sheet.max_row = max(sheet.max_row, row_index)
+                        element.clear()
+                        continue
+                    for row, column, value, style_id in parser.parse_row(element, row_index):
+                        sheet.max_row = max(sheet.max_row, row)
+                        if column == 1 and wide_from is not None and str(value).lower().strip() == wide_from:
+                            wide = True
+                        if wide or max_column is None or column <= max_column:
+                            sheet.cells[(row, column)] = (value, styles[style_id])
+                    element.clear()
+                elif element.tag == MERGE_TAG:
+                    # Like openpyxl, only the top-left cell of a merged range
+                    # keeps its value; the others are blank and unstyled.
+                    min_col, min_row, max_col, last_row = range_boundaries(element.get('ref'))
+                    sheet.max_row = max(sheet.max_row, last_row)
+                    for row in range(min_row, min(last_row, max_row or last_row) + 1):
+                        for column in range(min_col, max_col + 1):
+                            if (row, column) != (min_row, min_col) and (row, column) in sheet.cells:
+                                sheet.cells[(row, column)] = (None, default_flags)
+        return sheet
+
+class WorksheetParser:
+
+    def __init__(self, shared_strings, epoch=WINDOWS_EPOCH, date_formats=(), timedelta_formats=()):
+        self.shared_strings    = shared_strings
+        self.epoch             = epoch
+        self.date_formats      = date_formats
+        self.timedelta_formats = timedelta_formats
+        self.shared_formulae   = {}
+
+    def iter_values(self, src, max_row=None):
+        max_col   = None
+        empty_row = ()
+        counter   = 1
+        row_index = 0
+        for _, element in iterparse(src):
+            if element.tag == DIMENSION_TAG:
+                max_col   = range_boundaries(element.get('ref'))[2]
+                empty_row = (None,) * max_col
+            elif element.tag == ROW_TAG:
+                row_index = self.row_index(element, row_index)
+                if max_row is not None and row_index > max_row:
+                    break
+                cells = self.parse_row(element, row_index)
+                element.clear()
+                while counter < row_index:
+                    counter = counter + 1
+                    yield empty_row
+                if counter <= row_index:
+                    counter = counter + 1
+                    yield self.row_values(cells, max_col)
+        if max_row is not None and max_row < row_index:
+            for _ in range(counter, max_row + 1):
+                yield empty_row
+
+    def row_index(self, element, previous):
+        index = element.get('r')
+        if index is None:
+            return previous + 1
+        try:
+            return int(index)
+        except ValueError:
+            value = float(index)
+            if not value.is_integer():
+                raise ValueError(index + ' is not a valid row number')
+            return int(value)
+
+    def row_values(self, cells, max_col):
+        if not cells and not max_col:
+            return ()
+        width  = max_col or cells[-1][1]
+        values = [None] * width
+        for _, column, value, _ in cells:
+            if 1 <= column <= width:
+                values[column - 1] = value
+        return tuple(values)
+
+    def parse_row(self, element, row_index):
+        # (row, column, value, style index) for every cell of a <row>.
+        cells  = []
+        column = 0
+        for cell in element:
+            coordinate = cell.get('r')
+            row = row_index
+            if coordinate:
+                row, column = coordinate_to_tuple(coordinate)
+            else:
+                column = column + 1
+            cells.append((row, column, self.parse_value(cell, coordinate), int(cell.get('s') or 0)))
+        return cells
+
+    def parse_value(self, element, coordinate):
+        data_type = element.get('t', 'n')
+        if element.find(FORMULA_TAG) is not None:
+            return self.parse_formula(element, coordinate)
+        if data_type == 'inlineStr':
+            child = element.find(INLINE_STRING)
+            return text_content(child) if child is not None else None
+        value = element.findtext(VALUE_TAG, None) or None
+        if value is None:
+            return None
+        if data_type == 'n':
+            value = float(value) if '.' in value or 'E' in value or 'e' in value else int(value)
+            style_id = int(element.get('s') or 0)
+            if style_id in self.date_formats:
+                try:
+                    value = from_excel(value, self.epoch, timedelta=style_id in self.timedelta_formats)
+                except (OverflowError, ValueError):
+                    warnings.warn('Cell %s is marked as a date but the serial value %s is outside the limits for dates. '
+                                  'The cell will be treated as an error.' % (coordinate, value))
+                    value = '#VALUE!'
+        elif data_type == 's':
+            value = self.shared_strings[int(value)]
+        elif data_type == 'b':
+            value = bool(int(value))
+        elif data_type == 'd':
+            value = from_ISO8601(value)
+        return value
+
+    def parse_formula(self, element, coordinate):
+        formula      = element.find(FORMULA_TAG)
+        formula_type = formula.get('t')
+        value        = '='
+        if formula.text is not None:
+            value = value + formula.text
+        if formula_type == 'array':
+            value = ArrayFormula(ref=formula.get('ref'), text=value)
+        elif formula_type == 'shared':
+            index = formula.get('si')
+            if index in self.shared_formulae:
+                value = self.shared_formulae[index].translate_formula(coordinate)
+            elif value != '=':
+                self.shared_formulae[index] = Translator(value, coordinate)
+        elif formula_type == 'dataTable':
+            value = DataTableFormula(**formula.attrib)
+        return value
+
+def workbook_source(source):
+    # Paths and binary file-like objects are used as they are; a workbook
+    # held in memory as bytes is wrapped in a file object.
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+def sheet_count(filename):
+    with zipfile.ZipFile(filename) as archive:
+        return len(Package(archive).worksheets)
+
+def read_rows(filename, sheet_index=0, max_row=None):
+    # Rows 1..max_row of a worksheet as tuples of values.
+    with zipfile.ZipFile(filename) as archive:
+        return list(Package(archive).iter_values(sheet_index, max_row))
+
+def iter_sheet_rows(filename, max_row=None):
+    # Rows 1..max_row of every worksheet, one list per sheet, all read from
+    # one open archive.
+    with zipfile.ZipFile(filename) as archive:
+        package = Package(archive)
+        for index in range(len(package.worksheets)):
+            yield list(package.iter_values(index, max_row))
+
+def read_styled_sheets(filename, max_row=None, max_column=None, wide_from=None, first_values=None):
+    # With first_values, only the sheets whose A1 holds one of them are read;
+    # the others are parsed no further than their first row.
+    with zipfile.ZipFile(filename) as archive:
+        package = Package(archive)
+        return [package.read_styled_sheet(index, max_row, max_column, wide_from)
+                for index in range(len(package.worksheets))
+                if first_values is None or package.first_value(index) in first_values]